@@ -2,101 +2,157 @@ import asyncio
 import time
 import os
 import datetime
-from perception import extract_perception
-from memory import MemoryManager, MemoryItem
-from decision import generate_plan
+from perception import PerceptionResult, extract_perception
+from memory import MemoryManager, MemoryItem, RetentionPolicy
+from embedding import EMBED_BACKEND
+from decision import generate_plan, generate_step
 from action import execute_tool
+from tool_registry import ToolListWatcher, ToolRegistry
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
  # use this to connect to running server
 
 import shutil
 import sys
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Memories embedded by the local stand-in are kept apart from the real ones
+MEMORY_DIR = Path(__file__).parent.resolve() / ("memory_store" if EMBED_BACKEND == "ollama" else f"memory_store-{EMBED_BACKEND}")
+SERVER_PARAMS = StdioServerParameters(
+    command="python",
+    args=["example3.py"],
+    cwd="I:/TSAI/2025/EAG/Session 7/S7"
+)
+# The agent stores tool_output memories; older ones than this are forgotten
+MEMORY_RETENTION = RetentionPolicy(max_items=50_000, max_per_session=500, ttl={"tool_output": 30 * 24 * 3600})
 
 def log(stage: str, msg: str):
     now = datetime.datetime.now().strftime("%H:%M:%S")
     print(f"[{now}] [{stage}] {msg}")
 
 max_steps = 3
+MEMORY_TOP_K = 3       # closest memories of the current session per step
+PAST_MEMORY_TOP_K = 2  # plus the closest ones stored by earlier runs
+# two_call: perception and planning are separate LLM calls.
+# combined: one call returns both (see decision.generate_step), halving LLM latency per step.
+PLANNING_MODE = "two_call"
+
+def recall(memory: MemoryManager, user_input: str, session_id: str) -> List[MemoryItem]:
+    """Memories for the planner: this session's closest, then the closest from earlier runs.
+
+    Every run gets a new session id, so the session filter alone would never
+    bring back what earlier runs stored in MEMORY_DIR.
+    """
+    current = memory.retrieve(query=user_input, top_k=MEMORY_TOP_K, session_filter=session_id)
+    # Over-fetch: this session's own memories may take some of the unfiltered slots
+    anywhere = memory.retrieve(query=user_input, top_k=MEMORY_TOP_K + PAST_MEMORY_TOP_K)
+    return current + [m for m in anywhere if m.session_id != session_id][:PAST_MEMORY_TOP_K]
+
+async def plan_step(memory: MemoryManager, user_input: str, session_id: str,
+                    tool_descriptions: str) -> Tuple[PerceptionResult, List[MemoryItem], str]:
+    """Perception, memory retrieval and planning for one agent step.
+
+    LLM calls are async (see llm.py); retrieval blocks on its embedding call,
+    so it runs in a worker thread. Either way the event loop stays free for
+    the MCP session. Perception and retrieval don't depend on each other and
+    run concurrently; planning waits for both.
+    """
+    retrieval = asyncio.to_thread(recall, memory, user_input, session_id)
+    if PLANNING_MODE == "combined":
+        retrieved = await retrieval
+        log("memory", f"Retrieved {len(retrieved)} relevant memories")
+
+        perception, plan = await generate_step(user_input, retrieved, tool_descriptions)
+        log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
+        return perception, retrieved, plan
+
+    perception, retrieved = await asyncio.gather(extract_perception(user_input), retrieval)
+    log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
+    log("memory", f"Retrieved {len(retrieved)} relevant memories")
+
+    plan = await generate_plan(perception, retrieved, tool_descriptions)
+    return perception, retrieved, plan
+
+def new_session_id() -> str:
+    return f"session-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+
+async def run_query(session: ClientSession, registry: ToolRegistry, memory: MemoryManager,
+                    user_input: str, session_id: Optional[str] = None) -> Optional[str]:
+    """Run the agent loop for one query. Returns the FINAL_ANSWER line, or None if it gave up.
+
+    All state lives in this call, so several queries can run concurrently
+    over the same MCP session and memory.
+    """
+    session_id = session_id or new_session_id()
+    query = user_input  # Store original intent
+    step = 0
+
+    while step < max_steps:
+        log("loop", f"[{session_id}] Step {step + 1} started")
+
+        await registry.refresh(session)  # no-op unless the server announced a tool change
+        perception, retrieved, plan = await plan_step(memory, user_input, session_id, registry.descriptions)
+        log("plan", f"[{session_id}] Plan generated: {plan}")
+
+        if plan.startswith("FINAL_ANSWER:"):
+            log("agent", f"✅ FINAL RESULT: {plan}")
+            return plan
+
+        try:
+            result = await execute_tool(session, registry.by_name, plan)
+            log("tool", f"{result.tool_name} returned: {result.result}")
+
+            await asyncio.to_thread(memory.add, MemoryItem(
+                text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
+                type="tool_output",
+                tool_name=result.tool_name,
+                user_query=user_input,
+                tags=[result.tool_name],
+                session_id=session_id
+            ))
+
+            user_input = f"Original task: {query}\nPrevious output: {result.result}\nWhat should I do next?"
+
+        except Exception as e:
+            log("error", f"Tool execution failed: {e}")
+            return None
+
+        step += 1
+
+    return None
 
 async def main(user_input: str):
     try:
         print("[agent] Starting agent...")
         print(f"[agent] Current working directory: {os.getcwd()}")
-        
-        server_params = StdioServerParameters(
-            command="python",
-            args=["example3.py"],
-            cwd="I:/TSAI/2025/EAG/Session 7/S7"
-        )
 
         try:
-            async with stdio_client(server_params) as (read, write):
+            async with stdio_client(SERVER_PARAMS) as (read, write):
                 print("Connection established, creating session...")
                 try:
-                    async with ClientSession(read, write) as session:
+                    watcher = ToolListWatcher()
+                    async with ClientSession(read, write, message_handler=watcher) as session:
                         print("[agent] Session created, initializing...")
  
                         try:
-                            await session.initialize()
+                            init = await session.initialize()
                             print("[agent] MCP session initialized")
 
-                            # Your reasoning, planning, perception etc. would go here
-                            tools = await session.list_tools()
-                            print("Available tools:", [t.name for t in tools.tools])
-
                             # Get available tools
-                            print("Requesting tool list...")
-                            tools_result = await session.list_tools()
-                            tools = tools_result.tools
-                            tool_descriptions = "\n".join(
-                                f"- {tool.name}: {getattr(tool, 'description', 'No description')}" 
-                                for tool in tools
-                            )
-
-                            log("agent", f"{len(tools)} tools loaded")
-
-                            memory = MemoryManager()
-                            session_id = f"session-{int(time.time())}"
-                            query = user_input  # Store original intent
-                            step = 0
-
-                            while step < max_steps:
-                                log("loop", f"Step {step + 1} started")
-
-                                perception = extract_perception(user_input)
-                                log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
-
-                                retrieved = memory.retrieve(query=user_input, top_k=3, session_filter=session_id)
-                                log("memory", f"Retrieved {len(retrieved)} relevant memories")
-
-                                plan = generate_plan(perception, retrieved, tool_descriptions=tool_descriptions)
-                                log("plan", f"Plan generated: {plan}")
-
-                                if plan.startswith("FINAL_ANSWER:"):
-                                    log("agent", f"✅ FINAL RESULT: {plan}")
-                                    break
-
-                                try:
-                                    result = await execute_tool(session, tools, plan)
-                                    log("tool", f"{result.tool_name} returned: {result.result}")
-
-                                    memory.add(MemoryItem(
-                                        text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
-                                        type="tool_output",
-                                        tool_name=result.tool_name,
-                                        user_query=user_input,
-                                        tags=[result.tool_name],
-                                        session_id=session_id
-                                    ))
-
-                                    user_input = f"Original task: {query}\nPrevious output: {result.result}\nWhat should I do next?"
-
-                                except Exception as e:
-                                    log("error", f"Tool execution failed: {e}")
-                                    break
-
-                                step += 1
+                            registry = watcher.registry = ToolRegistry.for_server(init)
+                            await registry.refresh(session)
+                            print("Available tools:", list(registry.by_name))
+
+                            log("agent", f"{len(registry.tools)} tools loaded")
+
+                            memory = MemoryManager(path=MEMORY_DIR, retention=MEMORY_RETENTION)
+                            try:
+                                await run_query(session, registry, memory, user_input)
+                            finally:
+                                # Snapshot even when the query failed, so the next start doesn't re-index
+                                memory.close()
                         except Exception as e:
                             print(f"[agent] Session initialization error: {str(e)}")
                 except Exception as e:
@@ -0,0 +1,151 @@
+# agent_service.py
+#
+# Long-lived agent: starts the MCP server (example3.py) and its ClientSession
+# once, then answers many queries concurrently over that one connection.
+#
+#   python agent_service.py                     # serve on 127.0.0.1:8765
+#   python agent_service.py ask "What is the relationship between Gensol and Go-Auto?"
+#
+# Protocol: newline-delimited JSON over TCP. Each request line is
+#   {"id": "q1", "query": "...", "session_id": "optional, to continue a session"}
+# and gets one response line when its query finishes (responses on a
+# connection may arrive in any order):
+#   {"id": "q1", "session_id": "...", "answer": "FINAL_ANSWER: [...]" | null, "seconds": 4.2}
+#   {"id": "q1", "error": "..."}
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Optional
+
+from mcp import ClientSession
+from mcp.client.stdio import stdio_client
+
+from agent import MEMORY_DIR, MEMORY_RETENTION, SERVER_PARAMS, log, new_session_id, run_query
+from memory import MemoryManager
+from tool_registry import ToolListWatcher, ToolRegistry
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_CONCURRENT_QUERIES = 16  # agent sessions running at once; the rest wait their turn
+
+
+class AgentService:
+    """Runs agent queries concurrently over one initialized MCP session.
+
+    The tool registry and the memory are loaded once and shared; everything
+    specific to a query (session id, step count, the evolving prompt) lives
+    in its run_query() call.
+    """
+
+    def __init__(self, session: ClientSession, registry: ToolRegistry, memory: MemoryManager,
+                 max_concurrent: int = MAX_CONCURRENT_QUERIES):
+        self.session = session
+        self.registry = registry
+        self.memory = memory
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.served = 0
+
+    async def answer(self, query: str, session_id: Optional[str] = None) -> dict:
+        session_id = session_id or new_session_id()
+        async with self._slots:
+            self.active += 1
+            start = time.perf_counter()
+            try:
+                answer = await run_query(self.session, self.registry, self.memory, query, session_id)
+            finally:
+                self.active -= 1
+                self.served += 1
+        return {"session_id": session_id, "answer": answer, "seconds": round(time.perf_counter() - start, 3)}
+
+    async def _respond(self, request: dict, writer: asyncio.StreamWriter, lock: asyncio.Lock) -> None:
+        try:
+            if not isinstance(request.get("query"), str):
+                raise ValueError("request needs a string 'query'")
+            response = await self.answer(request["query"], request.get("session_id"))
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+        line = json.dumps({"id": request.get("id"), **response}) + "\n"
+        async with lock:
+            writer.write(line.encode("utf-8"))
+            await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve one client connection: every request line starts a query right away."""
+        pending = set()
+        lock = asyncio.Lock()  # one response line at a time
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as e:
+                    async with lock:
+                        writer.write((json.dumps({"id": None, "error": f"bad request: {e}"}) + "\n").encode("utf-8"))
+                        await writer.drain()
+                    continue
+                task = asyncio.create_task(self._respond(request, writer, lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            # The client finished sending; finish its queries before closing
+            await asyncio.gather(*pending, return_exceptions=True)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            for task in pending:
+                task.cancel()
+        finally:
+            writer.close()
+
+
+async def serve(host: str = HOST, port: int = PORT) -> None:
+    async with stdio_client(SERVER_PARAMS) as (read, write):
+        watcher = ToolListWatcher()
+        async with ClientSession(read, write, message_handler=watcher) as session:
+            init = await session.initialize()
+            log("service", "MCP session initialized")
+            registry = watcher.registry = ToolRegistry.for_server(init)
+            await registry.refresh(session)
+            log("service", f"{len(registry.tools)} tools loaded")
+            memory = MemoryManager(path=MEMORY_DIR, retention=MEMORY_RETENTION)
+            try:
+                service = AgentService(session, registry, memory)
+                server = await asyncio.start_server(service.handle, host, port)
+                log("service", f"Accepting queries on {host}:{port}")
+                async with server:
+                    await server.serve_forever()
+            finally:
+                memory.close()
+
+
+async def ask(query: str, host: str = HOST, port: int = PORT) -> dict:
+    """Send one query to a running service and wait for its answer."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps({"id": 1, "query": query}) + "\n").encode("utf-8"))
+    await writer.drain()
+    writer.write_eof()
+    response = json.loads(await reader.readline())
+    writer.close()
+    return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve agent queries concurrently over one MCP session.")
+    parser.add_argument("command", nargs="?", choices=("serve", "ask"), default="serve")
+    parser.add_argument("query", nargs="?")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    if args.command == "ask":
+        if not args.query:
+            parser.error("ask needs a query")
+        print(json.dumps(asyncio.run(ask(args.query, args.host, args.port)), indent=2, ensure_ascii=False))
+    else:
+        try:
+            asyncio.run(serve(args.host, args.port))
+        except KeyboardInterrupt:
+            sys.stderr.write("Stopped.\n")
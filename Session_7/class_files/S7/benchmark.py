@@ -0,0 +1,274 @@
+# benchmark.py
+#
+# Retrieval quality and latency of search_documents over S7/documents.
+#
+#   python benchmark.py                                  # hash embeddings, every index type, current chunker
+#   python benchmark.py --embedder server                # the configured embedding server (EMBED_BACKEND)
+#   python benchmark.py --index hnsw --storage float32 int8 --chunker 512/64 256/32 --out after.json --baseline before.json
+#
+# Each run converts the documents once, then for every chunker setting chunks
+# and embeds them, and for every index type builds a real index generation
+# (the same files the server publishes) in a temporary directory and queries
+# it through IndexManager.search.
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import embedding
+from bm25 import BM25Index
+from chunking import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, chunk_text
+from doc_index import BM25_FILE, CONFIG_FILE, INDEX_FILE, IndexManager
+from embedding import EMBED_MODEL, HASH_EMBED_MODEL, embed_batch, embed_texts, hash_embed
+from metadata_store import MetadataStore, VectorStore
+from vector_index import IndexConfig, add_vectors, index_kind, index_storage, make_index, prepare_vectors, save_config
+
+ROOT = Path(__file__).parent.resolve()
+DOC_PATH = ROOT / "documents"
+QUERIES_FILE = ROOT / "benchmark_queries.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+MODES = ("vector", "hybrid")
+TOP_K = 5
+REPEATS = 5  # timed runs of each query; recall and MRR come from the first
+
+
+def _log(level: str, message: str) -> None:
+    sys.stderr.write(f"{level}: {message}\n")
+    sys.stderr.flush()
+
+
+class Embedder(NamedTuple):
+    model: str
+    documents: Callable[[List[str]], np.ndarray]
+    query: Callable[[str], np.ndarray]
+
+
+def make_embedder(kind: str) -> Embedder:
+    """hash: embedding.hash_embed in process. server: the EMBED_BACKEND server, with the on-disk cache off."""
+    if kind == "hash":
+        return Embedder(HASH_EMBED_MODEL, hash_embed, lambda text: hash_embed([text])[0])
+    # Time the model, not the cache
+    embedding.EMBED_CACHE_PATH = None
+    return Embedder(EMBED_MODEL, lambda texts: embed_texts(texts, desc="Embedding"),
+                    lambda text: embed_batch([text])[0])
+
+
+def load_queries(path: Path = QUERIES_FILE) -> List[dict]:
+    """Labelled queries: {"query": ..., "relevant": [{"doc": file name, "contains": [phrase, ...]}]}.
+
+    A chunk is relevant when it comes from one of the listed documents and
+    contains one of that document's phrases (case and whitespace ignored), so
+    the labels hold for any chunker setting.
+    """
+    return json.loads(Path(path).read_text())
+
+
+def _normalise(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def is_relevant(record: dict, query: dict) -> bool:
+    text = _normalise(record["chunk"])
+    return any(record["doc"] == label["doc"] and any(_normalise(p) in text for p in label["contains"])
+               for label in query["relevant"])
+
+
+def convert_documents(directory: Path = DOC_PATH) -> Dict[str, str]:
+    """File name -> markdown for every document MarkItDown can read."""
+    from markitdown import MarkItDown
+    converter = MarkItDown()
+    documents = {}
+    for path in sorted(Path(directory).glob("*.*")):
+        try:
+            documents[path.name] = converter.convert(str(path)).text_content
+        except Exception as e:
+            _log("WARN", f"Skipping {path.name}: {type(e).__name__}: {e}")
+    return documents
+
+
+def chunk_documents(documents: Dict[str, str], max_tokens: int, overlap_tokens: int) -> Dict[int, dict]:
+    """Chunk records keyed by chunk id, shaped like the ones example3 stores."""
+    records = {}
+    for name, markdown in documents.items():
+        for i, chunk in enumerate(chunk_text(markdown, max_tokens, overlap_tokens)):
+            records[len(records)] = {"doc": name, "chunk": chunk, "chunk_id": f"{Path(name).stem}_{i}"}
+    return records
+
+
+def publish(manager: IndexManager, config: IndexConfig, records: Dict[int, dict],
+            embeddings: np.ndarray) -> Tuple[faiss.Index, float]:
+    """Build the index for config and publish it as a generation. Returns (index, build seconds)."""
+    ids = np.arange(len(records), dtype=np.int64)
+    start = time.perf_counter()
+    index = make_index(embeddings.shape[1], config, training=embeddings)
+    add_vectors(index, embeddings, ids, config)
+    build = time.perf_counter() - start
+    bm25 = BM25Index()
+    for chunk_id, record in records.items():
+        bm25.add(chunk_id, record["chunk"])
+    with manager.writing():
+        with manager.stage(carry_metadata=False) as staged:
+            MetadataStore(staged).rewrite(records)
+            VectorStore(staged, index.d).append(ids, prepare_vectors(embeddings, config))
+            bm25.save(staged / BM25_FILE)
+            faiss.write_index(index, str(staged / INDEX_FILE))
+            save_config(staged / CONFIG_FILE, index, config)
+        manager.publish(index, bm25)
+    return index, build
+
+
+def evaluate(manager: IndexManager, queries: List[dict], relevant_counts: List[int], embedder: Embedder,
+             k: int, mode: str, repeats: int, nprobe: Optional[int], ef_search: Optional[int]) -> dict:
+    """recall@k, MRR and latency percentiles of one search mode over the labelled queries.
+
+    recall@k is the share of a query's relevant chunks in its top k, out of
+    at most k (a query with more relevant chunks than k can still score 1).
+    Latency covers the whole search: query embedding, FAISS, BM25 and
+    reading the hit records.
+    """
+    search = lambda text: manager.search(text, embedder.query, k=k, mode=mode, nprobe=nprobe, ef_search=ef_search)
+    search(queries[0]["query"])  # warm-up
+    recalls, reciprocal_ranks, latencies = [], [], []
+    for query, relevant in zip(queries, relevant_counts):
+        if not relevant:
+            continue
+        for run in range(repeats):
+            start = time.perf_counter()
+            hits = search(query["query"])
+            latencies.append(time.perf_counter() - start)
+            if run == 0:
+                ranks = [rank for rank, hit in enumerate(hits, 1) if is_relevant(hit, query)]
+                recalls.append(len(ranks) / min(k, relevant))
+                reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "queries": len(recalls),
+        f"recall@{k}": float(np.mean(recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "qps": len(latencies) / float(np.sum(latencies)),
+    }
+
+
+def run(index_types: List[str], storages: List[str], chunkers: List[Tuple[int, int]], modes: List[str],
+        embedder: Embedder, k: int = TOP_K, repeats: int = REPEATS,
+        nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[dict]:
+    queries = load_queries()
+    start = time.perf_counter()
+    documents = convert_documents()
+    _log("INFO", f"Converted {len(documents)} documents in {time.perf_counter() - start:.1f}s")
+    rows = []
+    for max_tokens, overlap_tokens in chunkers:
+        chunker = f"{max_tokens}/{overlap_tokens}"
+        start = time.perf_counter()
+        records = chunk_documents(documents, max_tokens, overlap_tokens)
+        chunk_s = time.perf_counter() - start
+        texts = [record["chunk"] for record in records.values()]
+        start = time.perf_counter()
+        embeddings = embedder.documents(texts)
+        embed_s = time.perf_counter() - start
+        relevant_counts = [sum(is_relevant(record, query) for record in records.values()) for query in queries]
+        unlabelled = [query["query"] for query, n in zip(queries, relevant_counts) if not n]
+        if unlabelled:
+            _log("WARN", f"Chunker {chunker}: no relevant chunk for {len(unlabelled)} queries, left out: {unlabelled}")
+        _log("INFO", f"Chunker {chunker}: {len(records)} chunks, chunked in {chunk_s:.2f}s, "
+                     f"embedded in {embed_s:.2f}s ({len(records) / embed_s:.0f} chunks/s)")
+
+        for index_type in index_types:
+            for storage in storages:
+                # IVF is trained on whatever the corpus has, rather than waiting for train_threshold chunks
+                config = IndexConfig(index_type=index_type, metric="cosine", storage=storage, train_threshold=0)
+                with tempfile.TemporaryDirectory(prefix="s7-bench-") as tmp:
+                    manager = IndexManager(Path(tmp))
+                    try:
+                        index, build_s = publish(manager, config, records, embeddings)
+                    except Exception as e:
+                        # e.g. IVF-PQ needs 2**pq_nbits training vectors
+                        _log("WARN", f"Skipping {index_type}/{storage} with chunker {chunker}: {e}")
+                        continue
+                    indexing = {
+                        "chunker": chunker,
+                        "index_type": index_type,
+                        "storage": storage,
+                        "built": f"{index_kind(index)}/{index_storage(index)}",
+                        "chunks": len(records),
+                        "build_s": build_s,
+                        "index_chunks_per_s": len(records) / (chunk_s + embed_s + build_s),
+                    }
+                    for mode in modes:
+                        rows.append({**indexing, "mode": mode,
+                                     **evaluate(manager, queries, relevant_counts, embedder, k, mode, repeats,
+                                                nprobe, ef_search)})
+    return rows
+
+
+def _key(row: dict) -> Tuple:
+    return row["chunker"], row["index_type"], row["storage"], row["mode"]
+
+
+def print_table(rows: List[dict], k: int, baseline: Optional[List[dict]] = None) -> None:
+    """One line per configuration; with a baseline, changes against the matching row follow in brackets."""
+    before = {_key(row): row for row in baseline or []}
+    columns = [("chunker", "{}"), ("index_type", "{}"), ("storage", "{}"), ("built", "{}"), ("mode", "{}"),
+               (f"recall@{k}", "{:.3f}"), ("mrr", "{:.3f}"), ("p50_ms", "{:.2f}"), ("p95_ms", "{:.2f}"),
+               ("p99_ms", "{:.2f}"), ("qps", "{:.0f}"), ("build_s", "{:.3f}"), ("index_chunks_per_s", "{:.0f}")]
+    lines = [[name for name, _ in columns]]
+    for row in rows:
+        line = []
+        for name, fmt in columns:
+            cell = fmt.format(row[name])
+            old = before.get(_key(row), {}).get(name)
+            if isinstance(old, (int, float)) and old:
+                cell += f" ({(row[name] - old) / old:+.0%})"
+            line.append(cell)
+        lines.append(line)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(columns))]
+    for line in lines:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def _chunker(value: str) -> Tuple[int, int]:
+    max_tokens, _, overlap_tokens = value.partition("/")
+    return int(max_tokens), int(overlap_tokens or 0)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark document search quality and latency.")
+    parser.add_argument("--embedder", choices=("hash", "server"), default="hash")
+    parser.add_argument("--index", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument("--storage", nargs="+", choices=("float32", "float16", "int8"), default=["float32"])
+    parser.add_argument("--chunker", nargs="+", type=_chunker, default=[(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)],
+                        metavar="TOKENS/OVERLAP")
+    parser.add_argument("--mode", nargs="+", choices=("vector", "keyword", "hybrid"), default=list(MODES))
+    parser.add_argument("-k", type=int, default=TOP_K)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--ef-search", type=int)
+    parser.add_argument("--out", type=Path, help="write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON from an earlier --out to compare against")
+    args = parser.parse_args(argv)
+
+    embedder = make_embedder(args.embedder)
+    rows = run(args.index, args.storage, args.chunker, args.mode, embedder, args.k, args.repeats,
+               args.nprobe, args.ef_search)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    if baseline is not None and (baseline["k"], baseline["embedder"]) != (args.k, embedder.model):
+        _log("WARN", f"Baseline used k={baseline['k']} with {baseline['embedder']}; not comparing")
+        baseline = None
+    print_table(rows, args.k, baseline and baseline["rows"])
+    if args.out:
+        args.out.write_text(json.dumps({"embedder": embedder.model, "k": args.k, "created": time.time(),
+                                        "rows": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
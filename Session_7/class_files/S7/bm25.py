@@ -0,0 +1,121 @@
+# bm25.py
+
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+_TERM_RE = re.compile(r"\w+")
+_QUOTED_RE = re.compile(r'"([^"]+)"')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TERM_RE.findall(text.lower())
+
+
+def exact_terms(query: str) -> List[str]:
+    """Terms a user expects to match literally: quoted words and identifiers containing digits (e.g. INVG67564)."""
+    quoted = [t for phrase in _QUOTED_RE.findall(query) for t in tokenize(phrase)]
+    identifiers = [t for t in tokenize(query) if any(c.isdigit() for c in t) and any(c.isalpha() for c in t)]
+    return quoted + identifiers
+
+
+class BM25Index:
+    """Okapi BM25 over chunk ids, kept as an in-memory inverted index.
+
+    Removing chunks only drops their lengths; their postings are skipped at
+    query time and physically pruned once they make up a fifth of the index.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)  # term -> {chunk id: term frequency}
+        self.doc_len: Dict[int, int] = {}
+        self.total_len = 0
+        self.dead = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, chunk_id: int, text: str) -> None:
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings[term][chunk_id] = tf
+        length = sum(terms.values())
+        self.doc_len[chunk_id] = length
+        self.total_len += length
+
+    def remove(self, chunk_ids: Iterable[int]) -> None:
+        for chunk_id in chunk_ids:
+            length = self.doc_len.pop(chunk_id, None)
+            if length is not None:
+                self.total_len -= length
+                self.dead += 1
+        if self.dead > len(self.doc_len) / 4:
+            self.prune()
+
+    def prune(self) -> None:
+        """Drop postings of removed chunks."""
+        for term in list(self.postings):
+            live = {i: tf for i, tf in self.postings[term].items() if i in self.doc_len}
+            if live:
+                self.postings[term] = live
+            else:
+                del self.postings[term]
+        self.dead = 0
+
+    def contains(self, term: str) -> bool:
+        return any(i in self.doc_len for i in self.postings.get(term, ()))
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Top k (chunk id, score) pairs for query, best first."""
+        if not self.doc_len:
+            return []
+        n = len(self.doc_len)
+        avg_len = self.total_len / n
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in postings.items():
+                length = self.doc_len.get(chunk_id)
+                if length is None:
+                    continue
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+    def save(self, path: Path) -> None:
+        if self.dead:
+            self.prune()
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "doc_len": self.doc_len,
+            "postings": {term: list(p.items()) for term, p in self.postings.items()},
+        }
+        Path(path).write_text(json.dumps(data, separators=(",", ":")))
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        data = json.loads(Path(path).read_text())
+        bm25 = cls(k1=data["k1"], b=data["b"])
+        bm25.doc_len = {int(i): n for i, n in data["doc_len"].items()}
+        bm25.total_len = sum(bm25.doc_len.values())
+        for term, pairs in data["postings"].items():
+            bm25.postings[term] = {i: tf for i, tf in pairs}
+        return bm25
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[int]], k: int, rrf_k: int = 60) -> List[int]:
+    """Fuse ranked id lists: each id scores sum(1 / (rrf_k + rank)) across lists."""
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] += 1 / (rrf_k + rank + 1)
+    return [i for i, _ in sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]]
@@ -0,0 +1,139 @@
+# chunking.py
+
+import io
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+# nomic-embed-text accepts 8192 tokens, but smaller chunks retrieve more precisely
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP_TOKENS = 64
+# Stored per document in doc_index_cache.json; documents chunked differently are re-indexed
+CHUNKER_VERSION = f"markdown-v1/{CHUNK_TOKENS}/{CHUNK_OVERLAP_TOKENS}"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_ATX_HEADING_RE = re.compile(r"#{1,6}\s")
+_SETEXT_UNDERLINE_RE = re.compile(r"=+|-+")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count: words and punctuation marks.
+
+    Word-piece tokenizers split some words further, so budgets set with this
+    should leave headroom below the model's hard limit.
+    """
+    return len(_TOKEN_RE.findall(text))
+
+
+def _blocks(lines: Iterable[str]) -> Iterator[Tuple[bool, str]]:
+    """Group markdown lines into (is_heading, text) blocks.
+
+    Paragraphs end at blank lines; fenced code blocks are kept whole; ATX
+    (# Title) and setext (Title / -----) headings are blocks of their own.
+    """
+    block: List[str] = []
+    in_fence = False
+    for line in lines:
+        line = line.rstrip("\n")
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            if in_fence:
+                block.append(line)
+                yield False, "\n".join(block)
+                block, in_fence = [], False
+            else:
+                if block:
+                    yield False, "\n".join(block)
+                block, in_fence = [line], True
+            continue
+        if in_fence:
+            block.append(line)
+        elif not stripped:
+            if block:
+                yield False, "\n".join(block)
+                block = []
+        elif _ATX_HEADING_RE.match(stripped):
+            if block:
+                yield False, "\n".join(block)
+                block = []
+            yield True, stripped
+        elif len(stripped) >= 3 and _SETEXT_UNDERLINE_RE.fullmatch(stripped) and len(block) == 1:
+            yield True, block[0].strip()
+            block = []
+        else:
+            block.append(line)
+    if block:
+        yield False, "\n".join(block)
+
+
+def _split_oversized(block: str, max_tokens: int, overlap_tokens: int) -> Iterator[str]:
+    """Window a single block that exceeds the budget on its own, with a token overlap."""
+    window: List[Tuple[str, int]] = []
+    size = 0
+    for word in block.split():
+        tokens = count_tokens(word)
+        if size + tokens > max_tokens and window:
+            yield " ".join(w for w, _ in window)
+            tail: List[Tuple[str, int]] = []
+            tail_size = 0
+            for w, t in reversed(window):
+                if tail_size + t > overlap_tokens:
+                    break
+                tail.insert(0, (w, t))
+                tail_size += t
+            window, size = tail, tail_size
+        window.append((word, tokens))
+        size += tokens
+    if window:
+        yield " ".join(w for w, _ in window)
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """Lazily split markdown into chunks of at most max_tokens.
+
+    Whole paragraphs, tables and code blocks are packed into each chunk, so
+    chunks break at structural boundaries instead of mid-sentence. A heading
+    starts a new chunk once the current one is a quarter full, keeping small
+    sections together. Consecutive chunks share trailing blocks up to
+    overlap_tokens; blocks larger than the budget are windowed by words.
+    The text is read line by line, never as one list of words.
+    """
+    current: List[Tuple[str, int]] = []
+    size = 0
+    fresh = False  # current holds more than carried-over overlap
+
+    def emit() -> str:
+        return "\n\n".join(b for b, _ in current)
+
+    for is_heading, block in _blocks(io.StringIO(text)):
+        tokens = count_tokens(block)
+        if is_heading and size >= max_tokens // 4:
+            if fresh:
+                yield emit()
+            current, size, fresh = [], 0, False
+
+        if tokens > max_tokens:
+            if fresh:
+                yield emit()
+            yield from _split_oversized(block, max_tokens, overlap_tokens)
+            current, size, fresh = [], 0, False
+            continue
+
+        if size + tokens > max_tokens:
+            if fresh:
+                yield emit()
+            # Carry trailing blocks forward as overlap, if they leave room for this one
+            carried: List[Tuple[str, int]] = []
+            carried_size = 0
+            for b, t in reversed(current):
+                if carried_size + t > overlap_tokens or carried_size + t + tokens > max_tokens:
+                    break
+                carried.insert(0, (b, t))
+                carried_size += t
+            current, size, fresh = carried, carried_size, False
+
+        current.append((block, tokens))
+        size += tokens
+        fresh = True
+
+    if fresh:
+        yield emit()
@@ -1,9 +1,8 @@
 from perception import PerceptionResult
 from memory import MemoryItem
-from typing import List, Optional
-from dotenv import load_dotenv
-from google import genai
-import os
+from typing import List, Optional, Tuple
+from llm import get_llm
+import ast
 
 # Optional: import log from agent if shared, else define locally
 try:
@@ -14,10 +13,37 @@ except ImportError:
         now = datetime.datetime.now().strftime("%H:%M:%S")
         print(f"[{now}] [{stage}] {msg}")
 
-load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+PLAN_GUIDANCE = """✅ Examples:
+- FUNCTION_CALL: add|a=5|b=3
+- FUNCTION_CALL: strings_to_chars_to_int|input.string=INDIA
+- FUNCTION_CALL: int_list_to_exponential_sum|input.int_list=[73,78,68,73,65]
+- FINAL_ANSWER: [42]
+
+✅ Examples:
+- User asks: "What’s the relationship between Cricket and Sachin Tendulkar"
+  - FUNCTION_CALL: search_documents|query="relationship between Cricket and Sachin Tendulkar"
+  - [receives a detailed document]
+  - FINAL_ANSWER: [Sachin Tendulkar is widely regarded as the "God of Cricket" due to his exceptional skills, longevity, and impact on the sport in India. He is the leading run-scorer in both Test and ODI cricket, and the first to score 100 centuries in international cricket. His influence extends beyond his statistics, as he is seen as a symbol of passion, perseverance, and a national icon. ]
+
+
+IMPORTANT:
+- 🚫 Do NOT invent tools. Use only the tools listed below.
+- 📄 If the question may relate to factual knowledge, use the 'search_documents' tool to look for the answer.
+- 🧮 If the question is mathematical or needs calculation, use the appropriate math tool.
+- 🤖 If the previous tool output already contains factual information, DO NOT search again. Instead, summarize the relevant facts and respond with: FINAL_ANSWER: [your answer]
+- Only repeat `search_documents` if the last result was irrelevant or empty.
+- ❌ Do NOT repeat function calls with the same parameters.
+- ❌ Do NOT output unstructured responses.
+- 🧠 Think before each step. Verify intermediate results mentally before proceeding.
+- 💥 If unsure or no tool fits, skip to FINAL_ANSWER: [unknown]
+- ✅ You have only 3 attempts. Final attempt must be FINAL_ANSWER]
+"""
+
+# Lines of a combined perception + decision response, before its FUNCTION_CALL / FINAL_ANSWER line
+STEP_FIELDS = ("INTENT", "ENTITIES", "TOOL_HINT")
 
-def generate_plan(
+
+async def generate_plan(
     perception: PerceptionResult,
     memory_items: List[MemoryItem],
     tool_descriptions: Optional[str] = None
@@ -52,46 +78,91 @@ Input Summary:
 - Entities: {', '.join(perception.entities)}
 - Tool hint: {perception.tool_hint or 'None'}
 
-✅ Examples:
-- FUNCTION_CALL: add|a=5|b=3
-- FUNCTION_CALL: strings_to_chars_to_int|input.string=INDIA
-- FUNCTION_CALL: int_list_to_exponential_sum|input.int_list=[73,78,68,73,65]
-- FINAL_ANSWER: [42]
+{PLAN_GUIDANCE}"""
 
-✅ Examples:
-- User asks: "What’s the relationship between Cricket and Sachin Tendulkar"
-  - FUNCTION_CALL: search_documents|query="relationship between Cricket and Sachin Tendulkar"
-  - [receives a detailed document]
-  - FINAL_ANSWER: [Sachin Tendulkar is widely regarded as the "God of Cricket" due to his exceptional skills, longevity, and impact on the sport in India. He is the leading run-scorer in both Test and ODI cricket, and the first to score 100 centuries in international cricket. His influence extends beyond his statistics, as he is seen as a symbol of passion, perseverance, and a national icon. ]
+    try:
+        raw = await get_llm().generate(prompt, stage="plan")
+        log("plan", f"LLM output: {raw}")
 
+        return _plan_line(raw)
 
-IMPORTANT:
-- 🚫 Do NOT invent tools. Use only the tools listed below.
-- 📄 If the question may relate to factual knowledge, use the 'search_documents' tool to look for the answer.
-- 🧮 If the question is mathematical or needs calculation, use the appropriate math tool.
-- 🤖 If the previous tool output already contains factual information, DO NOT search again. Instead, summarize the relevant facts and respond with: FINAL_ANSWER: [your answer]
-- Only repeat `search_documents` if the last result was irrelevant or empty.
-- ❌ Do NOT repeat function calls with the same parameters.
-- ❌ Do NOT output unstructured responses.
-- 🧠 Think before each step. Verify intermediate results mentally before proceeding.
-- 💥 If unsure or no tool fits, skip to FINAL_ANSWER: [unknown]
-- ✅ You have only 3 attempts. Final attempt must be FINAL_ANSWER]
-"""
+    except Exception as e:
+        log("plan", f"⚠️ Decision generation failed: {e}")
+        return "FINAL_ANSWER: [unknown]"
+
+
+def _plan_line(raw: str) -> str:
+    for line in raw.splitlines():
+        if line.strip().startswith("FUNCTION_CALL:") or line.strip().startswith("FINAL_ANSWER:"):
+            return line.strip()
 
+    return raw.strip()
+
+
+def parse_step(user_input: str, raw: str) -> Tuple[PerceptionResult, str]:
+    """Split a combined response into its perception fields and its FUNCTION_CALL / FINAL_ANSWER line."""
+    fields = {}
+    for line in raw.splitlines():
+        key, sep, value = line.strip().partition(":")
+        if sep and key.strip().upper() in STEP_FIELDS:
+            fields[key.strip().lower()] = value.strip()
+
+    entities = fields.get("entities", "")
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        raw = response.text.strip()
-        log("plan", f"LLM output: {raw}")
+        # Tolerate a Python list despite the instructions
+        parsed = ast.literal_eval(entities) if entities.startswith("[") else None
+    except (ValueError, SyntaxError):
+        parsed = None
+    if not isinstance(parsed, list):
+        parsed = [e.strip().strip("'\"") for e in entities.strip("[]").split(",")]
+
+    tool_hint = fields.get("tool_hint")
+    perception = PerceptionResult(
+        user_input=user_input,
+        intent=fields.get("intent") or None,
+        entities=[str(e) for e in parsed if str(e).strip()],
+        tool_hint=None if tool_hint in (None, "", "None", "none") else tool_hint
+    )
+    return perception, _plan_line(raw)
+
+
+async def generate_step(
+    user_input: str,
+    memory_items: List[MemoryItem],
+    tool_descriptions: Optional[str] = None
+) -> Tuple[PerceptionResult, str]:
+    """Perception and plan from a single LLM call: one round-trip per agent step instead of two."""
+
+    memory_texts = "\n".join(f"- {m.text}" for m in memory_items) or "None"
+
+    tool_context = f"\nYou have access to the following tools:\n{tool_descriptions}" if tool_descriptions else ""
+
+    prompt = f"""
+You are a reasoning-driven AI agent with access to tools. Your job is to solve the user's request step-by-step by reasoning through the problem, selecting a tool if needed, and continuing until the FINAL_ANSWER is produced.{tool_context}
+
+For the input below, first extract structured facts, then decide the next step. Respond with EXACTLY these four lines and nothing else:
+
+INTENT: (brief phrase about what the user wants)
+ENTITIES: comma-separated keywords or values (e.g., INDIA, ASCII)
+TOOL_HINT: (name of the MCP tool that might be useful, or None)
+FUNCTION_CALL: tool_name|param1=value1|param2=value2   -- or, when the final answer is known --   FINAL_ANSWER: [your final result]
 
-        for line in raw.splitlines():
-            if line.strip().startswith("FUNCTION_CALL:") or line.strip().startswith("FINAL_ANSWER:"):
-                return line.strip()
+Guidelines:
+- The last line is EXACTLY ONE of FUNCTION_CALL or FINAL_ANSWER.
+- Do NOT include extra text, explanation, or formatting.
+- Use nested keys (e.g., input.string) and square brackets for lists.
+- You can reference these relevant memories:
+{memory_texts}
 
-        return raw.strip()
+Input: "{user_input}"
+
+{PLAN_GUIDANCE}"""
+
+    try:
+        raw = await get_llm().generate(prompt, stage="step")
+        log("step", f"LLM output: {raw}")
+        return parse_step(user_input, raw)
 
     except Exception as e:
-        log("plan", f"⚠️ Decision generation failed: {e}")
-        return "FINAL_ANSWER: [unknown]"
+        log("step", f"⚠️ Combined perception and decision failed: {e}")
+        return PerceptionResult(user_input=user_input, intent=None), "FINAL_ANSWER: [unknown]"
@@ -0,0 +1,376 @@
+# doc_index.py
+
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Literal, NamedTuple, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from bm25 import BM25Index, exact_terms, reciprocal_rank_fusion
+from file_lock import FileLock
+from metadata_store import BLOB_FILE, OFFSETS_FILE, VECTORS_FILE, MetadataStore, VectorStore
+from vector_index import (RERANK_FACTOR, IndexConfig, add_vectors, export_vectors, index_storage, make_index, rerank,
+                          search_params)
+
+INDEX_FILE = "index.bin"
+BM25_FILE = "bm25.json"
+DOC_CACHE_FILE = "doc_index_cache.json"
+CONFIG_FILE = "index_config.json"
+LEGACY_METADATA_FILE = "metadata.json"  # chunk list of the flat layout, replaced by metadata_store
+MANIFEST_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+GENERATION_PREFIX = "gen-"
+STAGING_PREFIX = ".staging-"
+KEEP_GENERATIONS = 2  # the live one plus its predecessor, which in-flight searches may still be reading
+
+
+class IndexSnapshot(NamedTuple):
+    index: faiss.Index
+    metadata: MetadataStore  # chunk id -> {"id", "doc", "chunk", "chunk_id"}, read per hit
+    bm25: BM25Index
+    generation: int
+    vectors: Optional[VectorStore]  # float32 copies for reranking reduced-precision indexes
+
+
+SearchMode = Literal["hybrid", "vector", "keyword"]
+
+
+def new_doc_cache(model: Optional[str] = None) -> dict:
+    """Per-document bookkeeping: content hash and the half-open chunk id range [start, end),
+    plus the embedding model every vector in the index came from."""
+    return {"next_id": 0, "docs": {}, "model": model}
+
+
+def load_doc_cache(path: Path) -> Optional[dict]:
+    """Load doc_index_cache.json. Returns None for the old name -> hash format, which has no id ranges."""
+    if not path.exists():
+        return new_doc_cache()
+    cache = json.loads(path.read_text())
+    if "docs" not in cache or "next_id" not in cache:
+        return None
+    return cache
+
+
+def document_ids(doc_cache: dict, name: str) -> np.ndarray:
+    start, end = doc_cache["docs"][name]["ids"]
+    return np.arange(start, end, dtype=np.int64)
+
+
+def build_bm25(metadata: MetadataStore, doc_cache: dict) -> BM25Index:
+    """Build a keyword index over every chunk the doc cache lists, reading texts from the store."""
+    bm25 = BM25Index()
+    for name in doc_cache["docs"]:
+        for record in metadata.get_many(document_ids(doc_cache, name).tolist()):
+            if record is not None:
+                bm25.add(record["id"], record["chunk"])
+    return bm25
+
+
+def compact(index: faiss.Index, metadata: MetadataStore, doc_cache: dict, config: IndexConfig,
+            stored: Optional[VectorStore] = None) -> Tuple[faiss.Index, Dict[int, dict], dict, np.ndarray]:
+    """Renumber live chunks densely from 0 and rebuild the index without holes.
+
+    Returns the new (index, metadata records, doc_cache, vectors by new id) for
+    MetadataStore.rewrite() and a fresh VectorStore; the inputs are left
+    untouched. Vectors come from stored when it covers every chunk, so a
+    reduced-precision index is rebuilt from full-precision data.
+    """
+    ids, vectors = export_vectors(index)
+    exact = stored.get(ids) if stored is not None and len(ids) else None
+    if exact is not None:
+        vectors = exact
+    position = {chunk_id: i for i, chunk_id in enumerate(ids.tolist())}
+    new_metadata: Dict[int, dict] = {}
+    new_cache = new_doc_cache(doc_cache.get("model"))
+    order = []
+    for name, entry in sorted(doc_cache["docs"].items(), key=lambda kv: kv[1]["ids"][0]):
+        start, end = entry["ids"]
+        live = [i for i in range(start, end) if i in position]
+        first = len(order)
+        for old_id, record in zip(live, metadata.get_many(live)):
+            if record is None:
+                continue
+            new_metadata[len(order)] = {**record, "id": len(order)}
+            order.append(position[old_id])
+        new_cache["docs"][name] = {**entry, "ids": [first, len(order)]}
+    new_cache["next_id"] = len(order)
+
+    vectors = vectors[order]
+    compacted = make_index(index.d, config, training=vectors)
+    if len(order):
+        add_vectors(compacted, vectors, np.arange(len(order)), config)
+    return compacted, new_metadata, new_cache, vectors
+
+
+def _fsync_dir(path: Path) -> None:
+    # Directories can't be opened for fsync on Windows; renames there are durable enough
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_tree(path: Path) -> None:
+    for file in path.iterdir():
+        if file.is_file():
+            with open(file, "rb") as f:
+                os.fsync(f.fileno())
+    _fsync_dir(path)
+
+
+def _carry_over(src: Path, dst: Path) -> None:
+    """Hard-link src into dst, copying where links aren't supported.
+
+    Linking is safe for the metadata store because it is only ever appended
+    to: older generations never read past the slots they were published with.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class IndexManager:
+    """Keeps the document index resident for the life of the server.
+
+    On disk every indexing run writes a complete generation (index.bin,
+    bm25.json, the doc cache, the chunk store) into a staging directory,
+    renames it to gen-NNNNNN and then atomically replaces the CURRENT
+    manifest that names it. A crash at any point leaves the previous
+    generation intact and current. The flat layout written before
+    generations existed is still read, and migrated by the first publish.
+
+    Searches work on an immutable snapshot; publishing a new index swaps the
+    snapshot reference in one assignment, so in-flight searches finish on the
+    generation they started with. A generation published by another process
+    is picked up on the next search by checking the manifest. Chunk metadata
+    is not held in memory; only the k hits of a search are read from the
+    MetadataStore.
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self._lock = threading.RLock()
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._stamp: Optional[Tuple] = None
+        self._generation = 0
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.index_dir / MANIFEST_FILE
+
+    def read_manifest(self) -> Optional[dict]:
+        try:
+            return json.loads(self.manifest_path.read_text())
+        except FileNotFoundError:
+            return None
+
+    def source_dir(self) -> Path:
+        """Directory of the current generation, or index_dir itself for the legacy flat layout."""
+        manifest = self.read_manifest()
+        return self.index_dir / manifest["directory"] if manifest else self.index_dir
+
+    @property
+    def metadata(self) -> MetadataStore:
+        return MetadataStore(self.source_dir())
+
+    @property
+    def index_path(self) -> Path:
+        return self.source_dir() / INDEX_FILE
+
+    @property
+    def bm25_path(self) -> Path:
+        return self.source_dir() / BM25_FILE
+
+    @property
+    def doc_cache_path(self) -> Path:
+        return self.source_dir() / DOC_CACHE_FILE
+
+    @property
+    def config_path(self) -> Path:
+        return self.source_dir() / CONFIG_FILE
+
+    def load_bm25(self) -> BM25Index:
+        return BM25Index.load(self.bm25_path) if self.bm25_path.exists() else BM25Index()
+
+    def _file_stamp(self) -> Optional[Tuple]:
+        # The manifest is replaced, never rewritten, so a new inode means a new generation
+        for path in (self.manifest_path, self.index_dir / INDEX_FILE):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            return path.name, stat.st_ino, stat.st_mtime_ns, stat.st_size
+        return None
+
+    def _load(self, stamp: Tuple) -> None:
+        source = self.source_dir()
+        index = faiss.read_index(str(source / INDEX_FILE))
+        self._generation += 1
+        self._snapshot = IndexSnapshot(index, MetadataStore(source), self.load_bm25(), self._generation,
+                                       self._vector_store(source, index))
+        self._stamp = stamp
+
+    @staticmethod
+    def _vector_store(source: Path, index: faiss.Index) -> Optional[VectorStore]:
+        store = VectorStore(source, index.d)
+        return store if store.exists() else None
+
+    def vector_store(self, dim: int) -> VectorStore:
+        return VectorStore(self.source_dir(), dim)
+
+    def current(self) -> Optional[IndexSnapshot]:
+        """Return the live snapshot, reloading from disk only if a new generation was published."""
+        stamp = self._file_stamp()
+        if stamp is not None and stamp != self._stamp:
+            with self._lock:
+                # Re-check under the lock: another search or a writer may have reloaded already
+                stamp = self._file_stamp()
+                if stamp is not None and stamp != self._stamp:
+                    self._load(stamp)
+        return self._snapshot
+
+    def writing(self) -> threading.RLock:
+        """Hold while staging and publishing so no search reloads in between."""
+        return self._lock
+
+    def exclusive(self) -> FileLock:
+        """Lock shared by every process indexing into index_dir; hold it for a whole indexing run.
+
+        Without it two servers could stage the same generation number, delete
+        each other's staging directory, or append to the same linked chunk store.
+        """
+        return FileLock(self.index_dir / LOCK_FILE)
+
+    @contextmanager
+    def stage(self, carry_metadata: bool = True) -> Iterator[Path]:
+        """Yield an empty staging directory for the next generation and publish it on success.
+
+        With carry_metadata the current chunk store is linked in first, so
+        MetadataStore(staged).append() adds to it; otherwise the caller writes
+        a complete store. If the block raises, the staging directory is removed
+        and the current generation stays live. Writers in different processes
+        must hold exclusive() around it.
+        """
+        manifest = self.read_manifest()
+        previous = self.source_dir()
+        number = (manifest["generation"] if manifest else 0) + 1
+        staging = self.index_dir / f"{STAGING_PREFIX}{number:06d}"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        try:
+            if carry_metadata and MetadataStore(previous).exists():
+                for name in (BLOB_FILE, OFFSETS_FILE, VECTORS_FILE):
+                    if (previous / name).exists():
+                        _carry_over(previous / name, staging / name)
+            yield staging
+            _fsync_tree(staging)
+            target = self.index_dir / f"{GENERATION_PREFIX}{number:06d}"
+            # Left behind by a crash between the rename and the manifest write
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(staging, target)
+            _fsync_dir(self.index_dir)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self._write_manifest({"generation": number, "directory": target.name, "created": time.time()})
+        if manifest is None:
+            self._remove_legacy_files()
+        self._collect_garbage(number)
+
+    def update_doc_cache(self, doc_cache: dict) -> None:
+        """Replace the current generation's doc cache in place, for bookkeeping-only changes such as file stats.
+
+        Only indexing runs read it, and they hold exclusive(), so this needs no new generation.
+        """
+        path = self.doc_cache_path
+        text = json.dumps(doc_cache, indent=2)
+        if path.exists() and path.read_text() == text:
+            return
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(text)
+        os.replace(tmp, path)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        tmp = self.manifest_path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+        _fsync_dir(self.index_dir)
+
+    def _remove_legacy_files(self) -> None:
+        for name in (INDEX_FILE, BM25_FILE, DOC_CACHE_FILE, CONFIG_FILE, LEGACY_METADATA_FILE,
+                     BLOB_FILE, OFFSETS_FILE, VECTORS_FILE):
+            (self.index_dir / name).unlink(missing_ok=True)
+
+    def _collect_garbage(self, current: int) -> None:
+        """Remove generations older than the last KEEP_GENERATIONS and abandoned staging or orphaned ones."""
+        for path in self.index_dir.iterdir():
+            if path.name.startswith(STAGING_PREFIX):
+                shutil.rmtree(path, ignore_errors=True)
+            elif path.name.startswith(GENERATION_PREFIX):
+                number = int(path.name[len(GENERATION_PREFIX):])
+                if not current - KEEP_GENERATIONS < number <= current:
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def publish(self, index: faiss.Index, bm25: BM25Index) -> None:
+        """Swap in a freshly built index. Call after stage() published its files, inside writing()."""
+        with self._lock:
+            self._generation += 1
+            source = self.source_dir()
+            self._snapshot = IndexSnapshot(index, MetadataStore(source), bm25, self._generation,
+                                           self._vector_store(source, index))
+            self._stamp = self._file_stamp()
+
+    def search(self, query: str, embed: Callable[[str], np.ndarray], k: int = 5, mode: SearchMode = "hybrid",
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[dict]:
+        """Top k chunk records for query.
+
+        vector ranks by embedding distance, keyword by BM25, and hybrid fuses
+        both with reciprocal rank fusion. In hybrid mode a query whose exact
+        identifiers (see bm25.exact_terms) all occur in the corpus is answered
+        from BM25 alone, skipping the embedding call.
+        """
+        if k < 1:
+            # FAISS would only fail an assert with an empty message
+            raise ValueError(f"k must be at least 1, got {k}")
+        snapshot = self.current()
+        if snapshot is None or snapshot.index.ntotal == 0:
+            return []
+
+        keyword: List[int] = []
+        if mode != "vector":
+            keyword = [i for i, _ in snapshot.bm25.search(query, k * 2)]
+            terms = exact_terms(query)
+            if mode == "keyword" or (keyword and terms and all(snapshot.bm25.contains(t) for t in terms)):
+                return self._records(snapshot, keyword[:k])
+
+        params = search_params(snapshot.index, nprobe=nprobe, ef_search=ef_search)
+        fetch = k * 2 if mode == "hybrid" else k
+        query_vec = embed(query).reshape(1, -1)
+        # Reduced-precision codes only shortlist; the final order comes from the float32 vectors
+        refine = snapshot.vectors is not None and index_storage(snapshot.index) != "float32"
+        D, I = snapshot.index.search(query_vec, fetch * RERANK_FACTOR if refine else fetch, params=params)
+        candidates = I[0][I[0] >= 0]
+        exact = snapshot.vectors.get(candidates) if refine and len(candidates) else None
+        if exact is not None:
+            _, candidates = rerank(query_vec, candidates, exact, fetch, snapshot.index.metric_type)
+        vector = [int(i) for i in candidates[:fetch]]
+        if mode == "vector":
+            return self._records(snapshot, vector[:k])
+        return self._records(snapshot, reciprocal_rank_fusion([vector, keyword], k))
+
+    @staticmethod
+    def _records(snapshot: IndexSnapshot, ids: List[int]) -> List[dict]:
+        return [hit for hit in snapshot.metadata.get_many(ids) if hit is not None]
@@ -0,0 +1,118 @@
+# embed_server.py
+#
+# Offline stand-in for Ollama's embedding API, serving embedding.hash_embed() vectors:
+#
+#   POST /api/embed       {"model": ..., "input": "text" | ["text", ...]}  ->  {"model": ..., "embeddings": [[...], ...]}
+#   POST /api/embeddings  {"model": ..., "prompt": "text"}                ->  {"embedding": [...]}
+#   GET  /api/tags        the one model served
+#
+#   python embed_server.py [--port 11435] [--dim 768]
+#
+# then start example3.py / agent.py with EMBED_BACKEND=local (or put it in .env).
+# Vectors are deterministic, so indexes, caches and benchmarks built against it
+# are reproducible; they only capture shared vocabulary, not meaning.
+
+import argparse
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+from embedding import HASH_EMBED_DIM, HASH_EMBED_MODEL, LOCAL_EMBED_PORT, hash_embed
+
+MAX_BATCH = 4096  # texts per /api/embed request
+
+
+def _log(level: str, message: str) -> None:
+    sys.stderr.write(f"{level}: {message}\n")
+    sys.stderr.flush()
+
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so embedding.py's pooled sessions reuse connections
+    dim = HASH_EMBED_DIM
+
+    def log_message(self, format, *args) -> None:
+        pass  # one line per request would drown a load test
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Tuple[Optional[dict], Optional[str]]:
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError as e:
+            return None, f"invalid JSON: {e}"
+        if not isinstance(payload, dict):
+            return None, "request body must be a JSON object"
+        model = payload.get("model", HASH_EMBED_MODEL)
+        if model != HASH_EMBED_MODEL:
+            return None, f"model {model!r} not found; this server only serves {HASH_EMBED_MODEL!r}"
+        return payload, None
+
+    def do_GET(self) -> None:
+        if self.path == "/api/tags":
+            self._send(200, {"models": [{"name": HASH_EMBED_MODEL, "model": HASH_EMBED_MODEL,
+                                         "details": {"family": "hash", "embedding_length": self.dim}}]})
+        else:
+            self._send(404, {"error": f"no route {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path not in ("/api/embed", "/api/embeddings"):
+            self._send(404, {"error": f"no route {self.path}"})
+            return
+        payload, error = self._read_json()
+        if error is not None:
+            self._send(400, {"error": error})
+            return
+        if self.path == "/api/embeddings":
+            prompt = payload.get("prompt")
+            if not isinstance(prompt, str):
+                self._send(400, {"error": "prompt must be a string"})
+                return
+            self._send(200, {"embedding": hash_embed([prompt], self.dim)[0].tolist()})
+            return
+        texts = payload.get("input")
+        if isinstance(texts, str):
+            texts = [texts]
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            self._send(400, {"error": "input must be a string or a list of strings"})
+            return
+        if len(texts) > MAX_BATCH:
+            self._send(400, {"error": f"at most {MAX_BATCH} inputs per request"})
+            return
+        self._send(200, {"model": HASH_EMBED_MODEL, "embeddings": hash_embed(texts, self.dim).tolist()})
+
+
+def serve(host: str = "127.0.0.1", port: int = LOCAL_EMBED_PORT, dim: int = HASH_EMBED_DIM,
+          background: bool = False) -> ThreadingHTTPServer:
+    """Start the server. With background it runs on a daemon thread and the server is returned for shutdown()."""
+    handler = type("Handler", (EmbeddingHandler,), {"dim": dim})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    _log("INFO", f"Serving {dim}-dim {HASH_EMBED_MODEL} embeddings on http://{host}:{server.server_port}")
+    if background:
+        threading.Thread(target=server.serve_forever, name="embed-server", daemon=True).start()
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve deterministic hash embeddings over Ollama's API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=LOCAL_EMBED_PORT)
+    parser.add_argument("--dim", type=int, default=HASH_EMBED_DIM)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.dim)
@@ -0,0 +1,400 @@
+# embedding.py
+
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import requests
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+load_dotenv()
+
+HASH_EMBED_MODEL = "hash-embed-v1"
+HASH_EMBED_DIM = 768  # same width as nomic-embed-text
+OLLAMA_EMBED_MODEL = "nomic-embed-text"
+LOCAL_EMBED_PORT = 11435
+# ollama: a local Ollama serving nomic-embed-text.
+# local: embed_server.py, which serves hash_embed() vectors over the same API with no model or network; start it first.
+# OLLAMA_URL and EMBED_MODEL override the backend's defaults.
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "ollama")
+if EMBED_BACKEND not in ("ollama", "local"):
+    raise ValueError(f"EMBED_BACKEND must be ollama or local, not {EMBED_BACKEND!r}")
+OLLAMA_URL = os.getenv("OLLAMA_URL", f"http://localhost:{LOCAL_EMBED_PORT if EMBED_BACKEND == 'local' else 11434}")
+EMBED_URL = f"{OLLAMA_URL}/api/embed"            # batch endpoint: {"input": [...]}
+LEGACY_EMBED_URL = f"{OLLAMA_URL}/api/embeddings"  # single prompt endpoint: {"prompt": "..."}
+EMBED_MODEL = os.getenv("EMBED_MODEL", HASH_EMBED_MODEL if EMBED_BACKEND == "local" else OLLAMA_EMBED_MODEL)
+EMBED_BATCH_SIZE = 32
+EMBED_MAX_IN_FLIGHT = 4
+EMBED_MAX_RETRIES = 4
+EMBED_BACKOFF = 0.5
+EMBED_TIMEOUT = 120
+EMBED_CACHE_PATH = Path(__file__).parent.resolve() / "faiss_index" / "embedding_cache.sqlite"
+EMBED_CACHE_MAX_ENTRIES = 200_000
+QUERY_CACHE_MAX_ENTRIES = 1024
+QUERY_CACHE_TTL = 3600.0  # seconds; None keeps entries until evicted
+
+_HASH_WORD_RE = re.compile(r"\w+")
+
+_local = threading.local()
+
+
+def _log(level: str, message: str) -> None:
+    """Log to stderr; the MCP server owns stdout"""
+    sys.stderr.write(f"{level}: {message}\n")
+    sys.stderr.flush()
+
+
+def _session() -> requests.Session:
+    # One keep-alive session per worker thread
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def _post_with_retry(url: str, payload: dict, retries: int = EMBED_MAX_RETRIES) -> dict:
+    """POST with exponential backoff and full jitter. Client errors other than 429 are not retried."""
+    for attempt in range(retries + 1):
+        try:
+            response = _session().post(url, json=payload, timeout=EMBED_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            status = getattr(e.response, "status_code", None)
+            if attempt == retries or (status is not None and 400 <= status < 500 and status != 429):
+                raise
+            delay = random.uniform(0, EMBED_BACKOFF * (2 ** attempt))
+            _log("RETRY", f"Embedding request failed ({e}); retry {attempt + 1}/{retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[list]:
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model name, sha256 of the text).
+
+    Rows carry a last-used timestamp; once the table grows past max_entries the
+    least recently used tenth is evicted. Safe to share between threads.
+    """
+
+    def __init__(self, path: Path = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, key)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self.key(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            # SQLite caps bound parameters, so look keys up in slices
+            for part in iter_batches(sorted(set(keys)), 500):
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                found.update((k, np.frombuffer(v, dtype=np.float32)) for k, v in rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                    [(time.time(), model, k) for k in found],
+                )
+                self._conn.commit()
+            hits = sum(k in found for k in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [found.get(k) for k in keys]
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray) -> None:
+        now = time.time()
+        rows = [(model, self.key(t), np.ascontiguousarray(v, dtype=np.float32).tobytes(), now)
+                for t, v in zip(texts, vectors)]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._entries += self._conn.total_changes - before
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        target = int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (self._entries - target,),
+        )
+        _log("CACHE", f"Evicted {self._entries - target} embeddings from {self.path.name}")
+        self._entries = target
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": self._entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """The process-wide embedding cache, opened on first use. Set EMBED_CACHE_PATH to None to disable it."""
+    global _cache
+    if _cache is None and EMBED_CACHE_PATH is not None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(EMBED_CACHE_PATH)
+    return _cache
+
+
+class QueryCache:
+    """In-memory LRU of query embeddings, keyed by (model, query) with an optional TTL.
+
+    Queries are looked up with whitespace collapsed, so the same question
+    reformatted across agent steps still hits. Cached vectors are read-only
+    and shared between callers. Safe to share between threads.
+    """
+
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES, ttl: Optional[float] = QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, text: str) -> Tuple[str, str]:
+        return model, " ".join(text.split())
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = self.key(model, text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model: str, text: str, vector: np.ndarray) -> np.ndarray:
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[self.key(model, text)] = (time.monotonic(), vector)
+            self._entries.move_to_end(self.key(model, text))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_query_cache = QueryCache()
+
+
+def get_query_cache() -> QueryCache:
+    """The process-wide query embedding cache shared by document search and agent memory."""
+    return _query_cache
+
+
+def _embed_legacy(texts: List[str], url: str, model: str) -> np.ndarray:
+    return np.stack([
+        np.array(_post_with_retry(url, {"model": model, "prompt": t})["embedding"], dtype=np.float32)
+        for t in texts
+    ])
+
+
+def _embed_uncached(texts: List[str], url: str, model: str) -> np.ndarray:
+    if url.endswith("/api/embeddings"):
+        return _embed_legacy(texts, url, model)
+    try:
+        data = _post_with_retry(url, {"model": model, "input": list(texts)})
+        return np.array(data["embeddings"], dtype=np.float32)
+    except requests.HTTPError as e:
+        # Ollama < 0.3 has no /api/embed; fall back to one request per text
+        if getattr(e.response, "status_code", None) != 404:
+            raise
+        return _embed_legacy(texts, url[: -len("/api/embed")] + "/api/embeddings", model)
+
+
+@lru_cache(maxsize=1 << 18)
+def _hash_feature(feature: str) -> Tuple[int, float]:
+    # blake2b rather than hash(): str hashes are salted per process
+    value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return value >> 1, 1.0 if value & 1 else -1.0
+
+
+def hash_embed(texts: List[str], dim: int = HASH_EMBED_DIM) -> np.ndarray:
+    """Deterministic stand-in embeddings that need no model or server.
+
+    Each text is a signed feature-hashed bag of its lowercased words plus
+    their character trigrams (so "vehicle" and "vehicles" still overlap),
+    with log-scaled counts, L2-normalised. Texts sharing vocabulary score as
+    similar; there is no semantics beyond that. The same text gives the same
+    vector on every machine, which is what benchmarks and tests need.
+    """
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in zip(out, texts):
+        counts: Counter = Counter()
+        for word in _HASH_WORD_RE.findall(text.lower()):
+            counts["w:" + word] += 1
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                counts["c:" + padded[i:i + 3]] += 0.25
+        if not counts:
+            continue
+        features = [_hash_feature(f) for f in counts]
+        buckets = np.fromiter((h % dim for h, _ in features), dtype=np.int64, count=len(features))
+        signs = np.fromiter((s for _, s in features), dtype=np.float32, count=len(features))
+        np.add.at(row, buckets, signs * np.log1p(np.fromiter(counts.values(), dtype=np.float32, count=len(counts))))
+        norm = np.linalg.norm(row)
+        if norm > 0:
+            row /= norm
+    return out
+
+
+def embed_batch(texts: List[str], url: str = EMBED_URL, model: str = EMBED_MODEL) -> np.ndarray:
+    """Embed a list of texts, consulting the on-disk cache first.
+
+    Only cache misses are sent to the server, in a single request.
+    Returns a (len(texts), dim) float32 array.
+    """
+    texts = list(texts)
+    cache = get_cache()
+    if cache is None:
+        return _embed_uncached(texts, url, model)
+
+    cached = cache.get_many(model, texts)
+    missing = [i for i, v in enumerate(cached) if v is None]
+    if missing:
+        fresh = _embed_uncached([texts[i] for i in missing], url, model)
+        cache.put_many(model, [texts[i] for i in missing], fresh)
+        for i, v in zip(missing, fresh):
+            cached[i] = v
+    return np.stack(cached)
+
+
+def get_embedding(text: str, url: str = EMBED_URL, model: str = EMBED_MODEL) -> np.ndarray:
+    """Embed a single text. Goes through the same endpoint as embed_batch so query and document vectors are comparable."""
+    return embed_batch([text], url=url, model=model)[0]
+
+
+def embed_query(text: str, url: str = EMBED_URL, model: str = EMBED_MODEL) -> np.ndarray:
+    """Embed a search query through the in-memory query cache.
+
+    Misses go straight to the server, not through the on-disk cache, so
+    one-off queries don't crowd out document embeddings there. The returned
+    array is read-only.
+    """
+    cache = get_query_cache()
+    vector = cache.get(model, text)
+    if vector is None:
+        vector = cache.put(model, text, _embed_uncached([text], url, model)[0])
+    return vector
+
+
+def embed_stream(
+    texts: Iterable[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_in_flight: int = EMBED_MAX_IN_FLIGHT,
+    desc: str = "Embedding",
+    url: str = EMBED_URL,
+    model: str = EMBED_MODEL,
+) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Embed texts in batches with at most max_in_flight requests outstanding.
+
+    Yields (batch, embeddings) pairs in input order. The source iterable is only
+    pulled when a request slot frees up, so a slow embedding server applies
+    backpressure to whatever is producing the texts.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool, \
+            tqdm(desc=desc, unit="chunk", total=len(texts) if hasattr(texts, "__len__") else None,
+                 file=sys.stderr) as progress:
+        done_batches = 0
+
+        def drain_one():
+            nonlocal done_batches
+            batch, future = pending.popleft()
+            embeddings = future.result()
+            done_batches += 1
+            progress.update(len(batch))
+            progress.set_postfix(batches=done_batches)
+            return batch, embeddings
+
+        for batch in iter_batches(texts, batch_size):
+            pending.append((batch, pool.submit(embed_batch, batch, url, model)))
+            if len(pending) >= max_in_flight:
+                yield drain_one()
+        while pending:
+            yield drain_one()
+
+
+def embed_texts(texts: Iterable[str], **kwargs) -> np.ndarray:
+    """Embed all texts and return them stacked as one float32 array."""
+    parts = [embeddings for _, embeddings in embed_stream(texts, **kwargs)]
+    if not parts:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(parts)
@@ -4,59 +4,69 @@ from mcp.types import TextContent
 from mcp import types
 from PIL import Image as PILImage
 import math
+import asyncio
 import sys
 import os
 import json
 import faiss
 import numpy as np
 from pathlib import Path
-import requests
-from markitdown import MarkItDown
 import time
 from models import AddInput, AddOutput, SqrtInput, SqrtOutput, StringsToIntsInput, StringsToIntsOutput, ExpSumInput, ExpSumOutput
 from PIL import Image as PILImage
-from tqdm import tqdm
 import hashlib
+import threading
+from typing import Optional
+from embedding import EMBED_MODEL, OLLAMA_EMBED_MODEL, embed_query, embed_texts, get_cache, get_query_cache
+from chunking import CHUNKER_VERSION
+from ingest import convert_files
+from indexer import IndexingService
+from bm25 import BM25Index
+from doc_index import (BM25_FILE, CONFIG_FILE, DOC_CACHE_FILE, INDEX_FILE, LEGACY_METADATA_FILE, IndexManager,
+                       SearchMode, build_bm25, compact, document_ids, load_doc_cache, new_doc_cache)
+from metadata_store import MetadataStore, VectorStore
+from vector_index import (IndexConfig, add_vectors, conform, export_vectors, load_config, make_index, prepare_vectors,
+                          remove_ids, save_config)
 
 
 mcp = FastMCP("Calculator")
 
-EMBED_URL = "http://localhost:11434/api/embeddings"
-EMBED_MODEL = "nomic-embed-text"
-CHUNK_SIZE = 256
-CHUNK_OVERLAP = 40
 ROOT = Path(__file__).parent.resolve()
-
-def get_embedding(text: str) -> np.ndarray:
-    response = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "prompt": text})
-    response.raise_for_status()
-    return np.array(response.json()["embedding"], dtype=np.float32)
-
-def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    words = text.split()
-    for i in range(0, len(words), size - overlap):
-        yield " ".join(words[i:i+size])
+# flat | ivf_flat | ivf_pq | hnsw. IVF types stay flat until train_threshold chunks are indexed.
+# metric: l2 | ip | cosine; changing it rebuilds the index from the stored vectors.
+# storage: float32 | float16 | int8; reduced precision keeps more chunks in RAM and reranks hits in float32.
+INDEX_CONFIG = IndexConfig(index_type="flat", metric="cosine", storage="float32")
+DOC_INDEX = IndexManager(ROOT / "faiss_index")
+# One indexing run at a time: the background service, ensure_faiss_ready() and compaction share the files.
+# DOC_INDEX.exclusive() extends that to other processes (agent.py starts a server per query).
+INDEXING_LOCK = threading.Lock()
+# The background IndexingService when running as a stdio server; None in dev mode and for compact
+INDEXING: Optional[IndexingService] = None
 
 def mcp_log(level: str, message: str) -> None:
     """Log a message to stderr to avoid interfering with JSON communication"""
     sys.stderr.write(f"{level}: {message}\n")
     sys.stderr.flush()
 
+def _search(query: str, k: int = 5, mode: SearchMode = "hybrid",
+            nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> list[str]:
+    hits = DOC_INDEX.search(query, embed_query, k=k, mode=mode, nprobe=nprobe, ef_search=ef_search)
+    mcp_log("CACHE", f"Query embeddings: {get_query_cache().stats()}")
+    return [f"{data['chunk']}\n[Source: {data['doc']}, ID: {data['chunk_id']}]" for data in hits]
+
 @mcp.tool()
-def search_documents(query: str) -> list[str]:
-    """Search for relevant content from uploaded documents."""
-    ensure_faiss_ready()
+async def search_documents(query: str, k: int = 5, mode: SearchMode = "hybrid",
+                           nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> list[str]:
+    """Search for relevant content from uploaded documents.
+    mode: hybrid (keywords + meaning, default), vector (meaning only) or keyword (exact words, e.g. invoice numbers or names).
+    nprobe (IVF indexes) and ef_search (HNSW indexes) trade speed for recall; leave unset for the index defaults."""
+    # Checks files (and may index when there is no background service), so off the event loop too
+    if not await asyncio.to_thread(ensure_faiss_ready):
+        return ["The document index is still being built; try again shortly."]
     mcp_log("SEARCH", f"Query: {query}")
     try:
-        index = faiss.read_index(str(ROOT / "faiss_index" / "index.bin"))
-        metadata = json.loads((ROOT / "faiss_index" / "metadata.json").read_text())
-        query_vec = get_embedding(query).reshape(1, -1)
-        D, I = index.search(query_vec, k=5)
-        results = []
-        for idx in I[0]:
-            data = metadata[idx]
-            results.append(f"{data['chunk']}\n[Source: {data['doc']}, ID: {data['chunk_id']}]")
-        return results
+        # Embedding and FAISS search block; keep them off the event loop so searches overlap
+        return await asyncio.to_thread(_search, query, k, mode, nprobe, ef_search)
     except Exception as e:
         return [f"ERROR: Failed to search: {str(e)}"]
 
@@ -216,68 +226,211 @@ def debug_error(error: str) -> list[base.Message]:
 
 def process_documents():
     """Process documents and create FAISS index"""
+    with INDEXING_LOCK, DOC_INDEX.exclusive():
+        _process_documents()
+
+
+def _process_documents():
     mcp_log("INFO", "Indexing documents with MarkItDown...")
     ROOT = Path(__file__).parent.resolve()
     DOC_PATH = ROOT / "documents"
     INDEX_CACHE = ROOT / "faiss_index"
     INDEX_CACHE.mkdir(exist_ok=True)
-    INDEX_FILE = INDEX_CACHE / "index.bin"
-    METADATA_FILE = INDEX_CACHE / "metadata.json"
-    CACHE_FILE = INDEX_CACHE / "doc_index_cache.json"
+    INDEX_FILE = DOC_INDEX.index_path
+    METADATA_FILE = INDEX_CACHE / LEGACY_METADATA_FILE
+    CACHE_FILE = DOC_INDEX.doc_cache_path
 
     def file_hash(path):
         return hashlib.md5(Path(path).read_bytes()).hexdigest()
 
-    CACHE_META = json.loads(CACHE_FILE.read_text()) if CACHE_FILE.exists() else {}
-    metadata = json.loads(METADATA_FILE.read_text()) if METADATA_FILE.exists() else []
+    CACHE_META = load_doc_cache(CACHE_FILE)
     index = faiss.read_index(str(INDEX_FILE)) if INDEX_FILE.exists() else None
-    all_embeddings = []
-    converter = MarkItDown()
-
+    store = DOC_INDEX.metadata
+    if METADATA_FILE.exists() and not store.exists():
+        # Makes the legacy index searchable in the meantime. metadata.json itself stays until the
+        # first generation is published, so a failed rebuild can't leave index.bin without metadata.
+        mcp_log("INFO", f"Migrated {store.import_json(METADATA_FILE)} chunks from metadata.json to {store.blob_path.name}")
+    rebuild = CACHE_META is None
+    if rebuild:
+        # Indexes built before per-document id ranges can't have documents removed; rebuild once
+        mcp_log("INFO", "Existing index has no per-document chunk ids. Rebuilding it.")
+    elif index is not None and (CACHE_META.get("model") or OLLAMA_EMBED_MODEL) != EMBED_MODEL:
+        # Vectors from different models aren't comparable (e.g. after switching EMBED_BACKEND)
+        mcp_log("INFO", f"Index was embedded with {CACHE_META.get('model') or OLLAMA_EMBED_MODEL}, "
+                        f"not {EMBED_MODEL}. Rebuilding it.")
+        rebuild = True
+    if rebuild:
+        CACHE_META, index = new_doc_cache(EMBED_MODEL), None
+    else:
+        # A run that died after appending metadata but before publishing leaves used slots behind
+        CACHE_META["next_id"] = max(CACHE_META["next_id"], len(store))
+    CACHE_META["model"] = EMBED_MODEL
+    docs = CACHE_META["docs"]
+    metadata = {}  # records for chunks added in this run
+    vectors = []  # (ids, float32 vectors) added in this run, kept for reranking reduced-precision indexes
+    if index is not None:
+        stored_vectors = DOC_INDEX.vector_store(index.d)
+        if stored_vectors.exists():
+            CACHE_META["next_id"] = max(CACHE_META["next_id"], len(stored_vectors))
+        else:
+            mcp_log("INFO", "Saving full-precision copies of existing vectors...")
+            vectors.append(export_vectors(index))
+    if rebuild or index is None:
+        bm25 = BM25Index()
+    elif DOC_INDEX.bm25_path.exists():
+        bm25 = DOC_INDEX.load_bm25()
+    else:
+        mcp_log("INFO", "Building keyword index for existing chunks...")
+        bm25 = build_bm25(store, CACHE_META)
+    # Whether this run has to publish a new generation, as opposed to only updating file stats
+    changed = rebuild or bool(vectors) or not DOC_INDEX.bm25_path.exists()
+
+    def drop_document(name):
+        nonlocal index, changed
+        changed = True
+        ids = document_ids(CACHE_META, name)
+        del docs[name]
+        if index is not None:
+            index = remove_ids(index, ids, INDEX_CONFIG)
+        bm25.remove(ids.tolist())
+
+    present = {file.name for file in DOC_PATH.glob("*.*")}
+    for name in [name for name in docs if name not in present]:
+        mcp_log("DEL", f"Removing deleted file: {name}")
+        drop_document(name)
+
+    pending = {}
     for file in DOC_PATH.glob("*.*"):
+        entry = docs.get(file.name)
+        st = file.stat()
+        stat = [st.st_mtime_ns, st.st_size]
+        # Same size and mtime as when indexed: skip hashing the file
+        if entry and entry.get("stat") == stat and entry.get("chunker") == CHUNKER_VERSION:
+            continue
         fhash = file_hash(file)
-        if file.name in CACHE_META and CACHE_META[file.name] == fhash:
+        if entry and entry["hash"] == fhash and entry.get("chunker") == CHUNKER_VERSION:
             mcp_log("SKIP", f"Skipping unchanged file: {file.name}")
+            entry["stat"] = stat
+            continue
+        pending[file] = (fhash, stat)
+
+    # Conversion runs in worker processes; each file is embedded as soon as it is chunked
+    for result in convert_files(pending):
+        file, (fhash, stat) = result.path, pending[result.path]
+        if result.error is not None:
+            mcp_log("ERROR", f"Failed to process {file.name}: {result.error}")
             continue
 
         mcp_log("PROC", f"Processing: {file.name}")
         try:
-            result = converter.convert(str(file))
-            markdown = result.text_content
-            chunks = list(chunk_text(markdown))
-            embeddings_for_file = []
-            new_metadata = []
-            for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding {file.name}")):
-                embedding = get_embedding(chunk)
-                embeddings_for_file.append(embedding)
-                new_metadata.append({"doc": file.name, "chunk": chunk, "chunk_id": f"{file.stem}_{i}"})
-            if embeddings_for_file:
+            chunks = result.chunks
+            embeddings_for_file = embed_texts(chunks, desc=f"Embedding {file.name}")
+            # Only drop the old version once the new one embedded successfully
+            if file.name in docs:
+                drop_document(file.name)
+            start = CACHE_META["next_id"]
+            ids = np.arange(start, start + len(chunks), dtype=np.int64)
+            if len(embeddings_for_file):
                 if index is None:
-                    dim = len(embeddings_for_file[0])
-                    index = faiss.IndexFlatL2(dim)
-                index.add(np.stack(embeddings_for_file))
-                metadata.extend(new_metadata)
-            CACHE_META[file.name] = fhash
+                    index = make_index(embeddings_for_file.shape[1], INDEX_CONFIG)
+                add_vectors(index, embeddings_for_file, ids, INDEX_CONFIG)
+                vectors.append((ids, prepare_vectors(embeddings_for_file, INDEX_CONFIG)))
+                for i, (chunk_id, chunk) in enumerate(zip(ids.tolist(), chunks)):
+                    metadata[chunk_id] = {"doc": file.name, "chunk": chunk, "chunk_id": f"{file.stem}_{i}"}
+                    bm25.add(chunk_id, chunk)
+            docs[file.name] = {"hash": fhash, "ids": [start, start + len(chunks)], "chunker": CHUNKER_VERSION, "stat": stat}
+            CACHE_META["next_id"] = start + len(chunks)
+            changed = True
         except Exception as e:
             mcp_log("ERROR", f"Failed to process {file.name}: {e}")
 
-    CACHE_FILE.write_text(json.dumps(CACHE_META, indent=2))
-    METADATA_FILE.write_text(json.dumps(metadata, indent=2))
-    if index and index.ntotal > 0:
-        faiss.write_index(index, str(INDEX_FILE))
-        mcp_log("SUCCESS", "Saved FAISS index and metadata")
-    else:
-        mcp_log("WARN", "No new documents or updates to process.")
+    cache = get_cache()
+    if cache is not None:
+        mcp_log("CACHE", f"Embedding cache: {cache.stats()}")
 
-def ensure_faiss_ready():
-    from pathlib import Path
-    index_path = ROOT / "faiss_index" / "index.bin"
-    meta_path = ROOT / "faiss_index" / "metadata.json"
-    if not (index_path.exists() and meta_path.exists()):
-        mcp_log("INFO", "Index not found — running process_documents()...")
-        process_documents()
-    else:
+    if index is not None:
+        # Trains IVF once the corpus passes the threshold, or converts after an INDEX_CONFIG change
+        conformed = conform(index, INDEX_CONFIG, load_config(DOC_INDEX.config_path))
+        changed = changed or conformed is not index
+        index = conformed
+
+    if index is not None and not changed:
+        # Rewriting every index file for the same chunks isn't worth it (agent.py starts a server per query)
+        DOC_INDEX.update_doc_cache(CACHE_META)
+        mcp_log("INFO", f"No document changes; {DOC_INDEX.source_dir().name} stays current.")
+        return
+
+    save_index(index, bm25, metadata, CACHE_META, vectors, rewrite=rebuild)
+
+
+def save_index(index, bm25, metadata, doc_cache, vectors=(), rewrite=False):
+    """Publish a new index generation.
+
+    metadata and vectors ((ids, array) pairs) cover new chunk ids only, unless rewrite replaces the whole store.
+    """
+    if index is None:
+        mcp_log("WARN", "No new documents or updates to process.")
+        return
+    with DOC_INDEX.writing():
+        # Everything goes into a staging directory that becomes current in one atomic step
+        with DOC_INDEX.stage(carry_metadata=not rewrite) as staged:
+            store = MetadataStore(staged)
+            if rewrite:
+                store.rewrite(metadata)
+            else:
+                store.append(metadata)
+            if vectors:
+                ids = np.concatenate([ids for ids, _ in vectors])
+                order = np.argsort(ids, kind="stable")
+                VectorStore(staged, index.d).append(ids[order], np.concatenate([v for _, v in vectors])[order])
+            (staged / DOC_CACHE_FILE).write_text(json.dumps(doc_cache, indent=2))
+            bm25.save(staged / BM25_FILE)
+            faiss.write_index(index, str(staged / INDEX_FILE))
+            save_config(staged / CONFIG_FILE, index, INDEX_CONFIG)
+        DOC_INDEX.publish(index, bm25)
+    mcp_log("SUCCESS", f"Saved FAISS index generation {DOC_INDEX.source_dir().name} ({index.ntotal} chunks)")
+
+
+def compact_documents():
+    """Renumber chunk ids densely and rewrite the index files without removed chunks"""
+    with INDEXING_LOCK, DOC_INDEX.exclusive():
+        _compact_documents()
+
+
+def _compact_documents():
+    doc_cache = load_doc_cache(DOC_INDEX.doc_cache_path)
+    index_path = DOC_INDEX.index_path
+    if doc_cache is None or not index_path.exists():
+        mcp_log("WARN", "Nothing to compact; run process_documents() first.")
+        return
+    index = faiss.read_index(str(index_path))
+    before = doc_cache["next_id"]
+    index, metadata, doc_cache, vectors = compact(index, DOC_INDEX.metadata, doc_cache, INDEX_CONFIG,
+                                                  DOC_INDEX.vector_store(index.d))
+    bm25 = BM25Index()
+    for chunk_id, record in metadata.items():
+        bm25.add(chunk_id, record["chunk"])
+    save_index(index, bm25, metadata, doc_cache, [(np.arange(len(vectors)), vectors)], rewrite=True)
+    mcp_log("SUCCESS", f"Compacted chunk id space from {before} to {doc_cache['next_id']}")
+
+def ensure_faiss_ready() -> bool:
+    """Return whether an index is ready to search.
+
+    With the background service running a missing index is queued for it
+    rather than built here, so a search never waits out a full indexing run.
+    """
+    index_path = DOC_INDEX.index_path
+    if index_path.exists() and DOC_INDEX.metadata.exists():
         mcp_log("INFO", "Index already exists. Skipping regeneration.")
+        return True
+    if INDEXING is not None:
+        if INDEXING.wait_idle(0):
+            mcp_log("INFO", "Index not found — queued for the background indexer.")
+            INDEXING.request()
+        return False
+    mcp_log("INFO", "Index not found — running process_documents()...")
+    process_documents()
+    return DOC_INDEX.index_path.exists()
 
 
 if __name__ == "__main__":
@@ -287,18 +440,20 @@ if __name__ == "__main__":
     
     if len(sys.argv) > 1 and sys.argv[1] == "dev":
         mcp.run() # Run without transport for dev server
+    elif len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact_documents()
     else:
+        # Index new and changed documents in the background; searches use the last published index meanwhile.
+        # Created before the server starts so a search never indexes on its own.
+        INDEXING = IndexingService(ROOT / "documents", process_documents)
+
         # Start the server in a separate thread
         import threading
         server_thread = threading.Thread(target=lambda: mcp.run(transport="stdio"))
         server_thread.daemon = True
         server_thread.start()
         
-        # Wait a moment for the server to start
-        time.sleep(2)
-        
-        # Process documents after server is running
-        process_documents()
+        INDEXING.start()
         
         # Keep the main thread alive
         try:
@@ -306,3 +461,4 @@ if __name__ == "__main__":
                 time.sleep(1)
         except KeyboardInterrupt:
             print("\nShutting down...")
+            INDEXING.stop()
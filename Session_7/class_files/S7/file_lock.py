@@ -0,0 +1,85 @@
+# file_lock.py
+
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_RETRY_INTERVAL = 0.1  # seconds between attempts where the OS lock can't block (Windows)
+
+
+class FileLock:
+    """Exclusive lock on a file, held across processes.
+
+    flock on POSIX, a one-byte msvcrt lock on Windows. The OS releases it
+    when the holder exits, crash included, so a lock file left on disk never
+    blocks anyone. Locks are per open file: two FileLocks on one path
+    exclude each other within a process as well.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """Take the lock. Returns False if it is held elsewhere and blocking is off or timeout passed."""
+        if self._file is not None:
+            raise RuntimeError(f"{self.path} is already locked by this FileLock")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path, "a+b")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not self._try_lock(f, blocking and deadline is None):
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    f.close()
+                    return False
+                time.sleep(_RETRY_INTERVAL)
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+        return True
+
+    @staticmethod
+    def _try_lock(f, wait: bool) -> bool:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+                return True
+            except BlockingIOError:
+                return False
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def release(self) -> None:
+        if self._file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
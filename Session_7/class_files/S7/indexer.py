@@ -0,0 +1,157 @@
+# indexer.py
+
+import queue
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+POLL_INTERVAL = 2.0     # seconds between directory scans
+SETTLE_TIME = 1.0       # quiet period after the last change before indexing starts
+
+FileStat = Tuple[int, int]  # (mtime_ns, size)
+
+
+def _log(level: str, message: str) -> None:
+    """Log to stderr; the MCP server owns stdout"""
+    sys.stderr.write(f"{level}: {message}\n")
+    sys.stderr.flush()
+
+
+def scan(directory: Path) -> Dict[str, FileStat]:
+    """Name -> (mtime_ns, size) for the files directly in directory."""
+    stats = {}
+    for path in Path(directory).glob("*.*"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        stats[path.name] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+
+class DirectoryWatcher:
+    """Polls a directory and reports files that were added, changed or removed.
+
+    Polling works on every platform and filesystem (including Docker bind
+    mounts, where inotify events don't arrive). A file is only reported once
+    its size and mtime are the same on two consecutive scans, so documents
+    still being copied in are not indexed half-written.
+    """
+
+    def __init__(self, directory: Path, on_change: Callable[[Set[str]], None], interval: float = POLL_INTERVAL):
+        self.directory = Path(directory)
+        self.on_change = on_change
+        self.interval = interval
+        self._reported: Dict[str, FileStat] = {}
+        self._previous: Dict[str, FileStat] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def poll(self) -> Set[str]:
+        """Scan once; return names whose stable state differs from what was last reported."""
+        current = scan(self.directory)
+        changed = set()
+        for name, stat in current.items():
+            if self._previous.get(name) == stat and self._reported.get(name) != stat:
+                self._reported[name] = stat
+                changed.add(name)
+        for name in list(self._reported):
+            if name not in current:
+                del self._reported[name]
+                changed.add(name)
+        self._previous = current
+        return changed
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                changed = self.poll()
+                if changed:
+                    self.on_change(changed)
+            except Exception as e:
+                _log("ERROR", f"Watching {self.directory} failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="doc-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class IndexingService:
+    """Background indexing: a watcher feeds changed file names into a queue and
+    one worker thread drains it, running index_fn once per burst of changes.
+
+    index_fn does the actual (incremental) indexing and publishes the new
+    index generation when done; searches keep using the previous generation
+    until then. Changes arriving while index_fn runs are coalesced into the
+    next run.
+    """
+
+    def __init__(self, directory: Path, index_fn: Callable[[], None],
+                 interval: float = POLL_INTERVAL, settle: float = SETTLE_TIME):
+        self.index_fn = index_fn
+        self.settle = settle
+        self.queue: "queue.Queue[Optional[Set[str]]]" = queue.Queue()
+        self.watcher = DirectoryWatcher(directory, self._enqueue, interval)
+        self.runs = 0
+        self._idle = threading.Event()
+        self._idle.set()
+        self._worker: Optional[threading.Thread] = None
+
+    def _enqueue(self, names: Set[str]) -> None:
+        self._idle.clear()
+        self.queue.put(names)
+
+    def _drain(self, first: Set[str]) -> Optional[Set[str]]:
+        """Collect everything queued until settle seconds pass with nothing new. None means stop."""
+        names = set(first)
+        while True:
+            try:
+                more = self.queue.get(timeout=self.settle)
+            except queue.Empty:
+                return names
+            if more is None:
+                return None
+            names |= more
+
+    def _run(self) -> None:
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            names = self._drain(first)
+            if names is None:
+                return
+            _log("INFO", f"Indexing {len(names)} changed file(s): {', '.join(sorted(names)[:5])}"
+                         f"{' ...' if len(names) > 5 else ''}")
+            try:
+                self.index_fn()
+            except Exception as e:
+                _log("ERROR", f"Background indexing failed: {e}")
+            self.runs += 1
+            if self.queue.empty():
+                self._idle.set()
+
+    def request(self) -> None:
+        """Queue a full rescan, e.g. after the index files were removed."""
+        self._enqueue({"*"})
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        return self._idle.wait(timeout)
+
+    def start(self) -> None:
+        self._worker = threading.Thread(target=self._run, name="doc-indexer", daemon=True)
+        self._worker.start()
+        self.watcher.start()  # the second scan sees every file as stable, triggering the initial run
+
+    def stop(self) -> None:
+        self.watcher.stop()
+        self.queue.put(None)
+        if self._worker is not None:
+            self._worker.join()
@@ -0,0 +1,153 @@
+# ingest.py
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from chunking import chunk_text
+
+CONVERT_WORKERS = os.cpu_count() or 1
+CONVERT_TIMEOUT = 300  # seconds one file may take before its worker is killed
+_POLL_INTERVAL = 0.5
+
+
+class ConvertResult(NamedTuple):
+    path: Path
+    chunks: Optional[List[str]]
+    error: Optional[str] = None
+
+
+def _worker_main(conn) -> None:
+    """Worker process: convert paths received on conn until it receives None."""
+    from markitdown import MarkItDown
+    converter = MarkItDown()
+    conn.send(None)  # ready; the per-file clock starts only after start-up
+    while True:
+        path = conn.recv()
+        if path is None:
+            return
+        try:
+            markdown = converter.convert(path).text_content
+            conn.send((path, list(chunk_text(markdown)), None))
+        except Exception as e:
+            conn.send((path, None, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.ready = False
+        self.path: Optional[Path] = None
+        self.started = 0.0
+
+    def assign(self, path: Path) -> None:
+        self.path, self.started = path, time.monotonic()
+        self.conn.send(str(path))
+
+    def stop(self) -> None:
+        """Ask an idle worker to exit; kill it if it is busy or doesn't comply."""
+        if self.process.is_alive() and self.path is None:
+            try:
+                self.conn.send(None)
+                self.process.join(timeout=1)
+            except OSError:
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+def _dispatch(paths: deque, workers: int, timeout: float, out: queue.Queue, stop: threading.Event) -> None:
+    ctx = multiprocessing.get_context("spawn")  # fork is unsafe with the server's threads
+    pool = [_Worker(ctx) for _ in range(min(workers, len(paths)))]
+
+    def emit(item) -> bool:
+        # Blocks while the consumer is busy (backpressure) but gives up if it went away
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        while (paths or any(w.path is not None for w in pool)) and not stop.is_set():
+            for w in pool:
+                if w.ready and w.path is None and paths:
+                    w.assign(paths.popleft())
+            waiting = [w.conn for w in pool if w.path is not None or not w.ready]
+            ready = multiprocessing.connection.wait(waiting, timeout=_POLL_INTERVAL)
+            for i, w in enumerate(pool):
+                if not w.ready and w.conn in ready:
+                    try:
+                        w.conn.recv()
+                    except EOFError:
+                        raise RuntimeError("Conversion worker failed to start (is markitdown installed?)")
+                    w.ready = True
+                    continue
+                if w.path is None:
+                    continue
+                healthy = True
+                if w.conn in ready:
+                    try:
+                        _, chunks, error = w.conn.recv()
+                        result = ConvertResult(w.path, chunks, error)
+                    except EOFError:
+                        result, healthy = ConvertResult(w.path, None, "worker process died"), False
+                elif time.monotonic() - w.started > timeout:
+                    result, healthy = ConvertResult(w.path, None, f"conversion timed out after {timeout}s"), False
+                else:
+                    continue
+                if healthy:
+                    w.path = None
+                else:
+                    # Kill the stuck or dead worker and replace it so the other files keep flowing
+                    w.stop()
+                    pool[i] = _Worker(ctx)
+                if not emit(result):
+                    return
+        emit(None)
+    except BaseException as e:
+        emit(e)
+    finally:
+        for w in pool:
+            w.stop()
+
+
+def convert_files(paths: Iterable[Path], workers: int = CONVERT_WORKERS,
+                  timeout: float = CONVERT_TIMEOUT) -> Iterator[ConvertResult]:
+    """Convert and chunk documents in a pool of worker processes.
+
+    Results are yielded as each file finishes, so the caller can embed one
+    file while the others are still converting. A file that takes longer than
+    timeout seconds is reported as an error and its worker is killed and
+    replaced, so one pathological PDF can't stall the run.
+    """
+    paths = deque(paths)
+    if not paths:
+        return
+    out: queue.Queue = queue.Queue(maxsize=max(1, workers))
+    stop = threading.Event()
+    thread = threading.Thread(target=_dispatch, args=(paths, workers, timeout, out, stop), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = out.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import random
+import weakref
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import errors
+
+# Optional: import log from agent if shared, else define locally
+try:
+    from agent import log
+except ImportError:
+    import datetime
+    def log(stage: str, msg: str):
+        now = datetime.datetime.now().strftime("%H:%M:%S")
+        print(f"[{now}] [{stage}] {msg}")
+
+load_dotenv()
+
+LLM_MODEL = "gemini-2.0-flash"
+LLM_TIMEOUT = 60.0          # seconds per attempt
+LLM_MAX_RETRIES = 3
+LLM_BACKOFF = 1.0           # base delay; attempt n waits up to LLM_BACKOFF * 2**n
+LLM_MAX_CONCURRENCY = 8     # requests in flight per event loop, across all agent sessions
+
+
+def _retryable(e: Exception) -> bool:
+    """Timeouts, dropped connections, rate limits and server errors are worth another try."""
+    if isinstance(e, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(e, errors.APIError):
+        return e.code == 429 or e.code >= 500
+    return False
+
+
+class LLMClient:
+    """Non-blocking Gemini client shared by the perception and decision layers.
+
+    Uses the SDK's native async API, so an LLM call never blocks the event
+    loop the MCP session runs on. Every call gets a timeout and is retried
+    with exponential backoff and full jitter on transient failures. A
+    semaphore caps the calls in flight so many concurrent agent sessions
+    don't trip the API's rate limits. Cancelling the awaiting task cancels
+    the request; it is never retried.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, model: str = LLM_MODEL, timeout: float = LLM_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES, backoff: float = LLM_BACKOFF,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.client = genai.Client(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        # asyncio primitives belong to one loop; keep a semaphore per loop
+        self._limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    def _limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._limits:
+            self._limits[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._limits[loop]
+
+    async def generate(self, prompt: str, stage: str = "llm") -> str:
+        """Return the stripped response text for prompt. Raises the last error once retries run out."""
+        async with self._limit():
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await asyncio.wait_for(
+                        self.client.aio.models.generate_content(model=self.model, contents=prompt),
+                        self.timeout
+                    )
+                    return (response.text or "").strip()
+                except Exception as e:
+                    if attempt == self.max_retries or not _retryable(e):
+                        raise
+                    delay = random.uniform(0, self.backoff * (2 ** attempt))
+                    reason = str(e) or f"no response within {self.timeout}s"
+                    log(stage, f"LLM call failed ({type(e).__name__}: {reason}); retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+
+
+_client: Optional[LLMClient] = None
+
+
+def get_llm() -> LLMClient:
+    """The process-wide LLM client, created on first use."""
+    global _client
+    if _client is None:
+        _client = LLMClient()
+    return _client
@@ -1,48 +1,358 @@
 # memory.py
 
-import numpy as np
+import functools
+import threading
 import faiss
-import requests
-from typing import List, Optional, Literal
-from pydantic import BaseModel
-from datetime import datetime
+import numpy as np
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Literal
+from pydantic import BaseModel, Field
+from datetime import datetime, timedelta
+from embedding import EMBED_URL, EMBED_MODEL, embed_query, embed_texts, get_embedding
+from memory_store import MemoryStore
+from vector_index import (RERANK_FACTOR, IndexConfig, add_vectors, conform, export_vectors, index_kind, index_storage,
+                          make_index, prepare_vectors, remove_ids, rerank, search_params, search_subset,
+                          similarity_matrix)
+
+SNAPSHOT_EVERY = 256  # persistent memories re-save the index after this many additions
+COMPACT_MIN_DEAD = 1024  # renumber once at least this many forgotten slots outnumber the live memories
+HNSW_REBUILD_DEAD_SHARE = 0.2  # HNSW can't delete in place; rebuild once this share of the graph is forgotten
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class MemoryItem(BaseModel):
     text: str
     type: Literal["preference", "tool_output", "fact", "query", "system"] = "fact"
-    timestamp: Optional[str] = datetime.now().isoformat()
+    timestamp: Optional[str] = Field(default_factory=lambda: datetime.now().isoformat())
     tool_name: Optional[str] = None
     user_query: Optional[str] = None
     tags: List[str] = []
     session_id: Optional[str] = None
 
 
+class RetentionPolicy(BaseModel):
+    """Bounds on what a MemoryManager keeps. Oldest memories are forgotten first."""
+    max_items: Optional[int] = None
+    max_per_session: Optional[int] = None
+    ttl: Dict[str, float] = {}  # MemoryItem.type -> seconds to keep; types not listed never expire
+    # Past max_items or max_per_session, forget down to this share of the limit in one go, so a full
+    # memory doesn't pay for an eviction (an index update) on every add
+    evict_to: float = Field(0.9, gt=0, le=1)
+    # tool_output memories of the same session and tool at least this cosine-similar are merged
+    # into the newest of them; None disables consolidation
+    merge_threshold: Optional[float] = 0.95
+
+
 class MemoryManager:
-    def __init__(self, embedding_model_url="http://localhost:11434/api/embeddings", model_name="nomic-embed-text"):
+    """Semantic memory for the agent.
+
+    With a path, memories are persisted to a MemoryStore there and reloaded on
+    the next start without re-embedding; call close() (or snapshot()) before
+    exit so the next start doesn't have to re-index recent additions. Only one
+    process can have a path open at a time (see MemoryStore).
+
+    Memory ids are positions in self.data; forgotten memories leave a None
+    slot until compact() renumbers the survivors.
+
+    Safe to share between threads (e.g. concurrent agent sessions): texts are
+    embedded outside the lock, the index and bookkeeping change under it.
+    """
+
+    def __init__(self, embedding_model_url=EMBED_URL, model_name=EMBED_MODEL, index_config: Optional[IndexConfig] = None,
+                 path: Optional[Path] = None, snapshot_every: int = SNAPSHOT_EVERY,
+                 retention: Optional[RetentionPolicy] = None):
         self.embedding_model_url = embedding_model_url
         self.model_name = model_name
+        self.index_config = index_config or IndexConfig(metric="cosine")
+        self.retention = retention or RetentionPolicy()
+        self.store = MemoryStore(path) if path is not None else None
+        self.snapshot_every = snapshot_every
+        self._lock = threading.RLock()
+        self._reset()
+        if self.store is not None:
+            self._load()
+
+    def _reset(self):
         self.index = None
-        self.data: List[MemoryItem] = []
-        self.embeddings: List[np.ndarray] = []
+        self.data: List[Optional[MemoryItem]] = []
+        self.live = 0
+        # Ordered sets (dict keys) of live memory ids per attribute value, for filtered retrieval
+        # and oldest-first eviction. Ids only grow, so each stays sorted.
+        self.by_type: Dict[str, Dict[int, None]] = defaultdict(dict)
+        self.by_session: Dict[str, Dict[int, None]] = defaultdict(dict)
+        self.by_tag: Dict[str, Dict[int, None]] = defaultdict(dict)
+        self._oldest = 0  # no live memory has a smaller id
+        self._snapshot_at = (0, 0)  # (items, deletions) covered by the last index snapshot
+        self._deletions = 0
+        # Forgotten ids still in an HNSW graph, skipped by searches until the next rebuild
+        self._dead_in_index: set = set()
+        self._skip_dead = None  # cached (IDSelectorNot, IDSelectorBatch) for _dead_in_index
+
+    def __len__(self) -> int:
+        return self.live
+
+    def _load(self):
+        if self.store.model is not None and self.store.model != self.model_name:
+            raise ValueError(f"Memory at {self.store.directory} was embedded with {self.store.model}, "
+                             f"not {self.model_name}; give this model its own path")
+        lines, vectors = self.store.load()
+        if not lines:
+            return
+        deleted = self.store.deleted()
+        dead = set(deleted.tolist())
+        self.data = [None if i in dead else MemoryItem.model_validate_json(line) for i, line in enumerate(lines)]
+        for item_id, item in enumerate(self.data):
+            if item is not None:
+                self._index_attributes(item_id, item)
+        self.live = len(self.data) - len(dead)
+        self._deletions = len(deleted)
+
+        index, covered, covered_deleted = self.store.load_index()
+        if index is None or covered > len(self.data) or covered_deleted > len(deleted):
+            self.index, covered, covered_deleted = make_index(vectors.shape[1], self.index_config), 0, 0
+        else:
+            self.index = index
+            if index_kind(index) == "hnsw":
+                # Ids forgotten before the snapshot may still be in the saved graph as well
+                self._drop_from_index(np.intersect1d(faiss.vector_to_array(index.id_map), deleted))
+            else:
+                self._drop_from_index(deleted[covered_deleted:])
+        # Index what was added after the last snapshot straight from the mapped vectors
+        ids = np.array([i for i in range(covered, len(self.data)) if self.data[i] is not None], dtype=np.int64)
+        if len(ids):
+            add_vectors(self.index, vectors[ids], ids, self.index_config)
+        self.index = conform(self.index, self.index_config)
+        self._snapshot_at = (covered, covered_deleted)
+
+    @_locked
+    def snapshot(self):
+        """Save the index so the next load starts from it."""
+        state = (len(self.data), self._deletions)
+        if self.store is not None and self.index is not None and self._snapshot_at != state:
+            self.store.save_index(self.index, *state)
+            self._snapshot_at = state
+
+    def close(self):
+        """Snapshot the index and release the store for other processes."""
+        self.snapshot()
+        if self.store is not None:
+            self.store.close()
 
     def _get_embedding(self, text: str) -> np.ndarray:
-        response = requests.post(
-            self.embedding_model_url,
-            json={"model": self.model_name, "prompt": text}
-        )
-        response.raise_for_status()
-        return np.array(response.json()["embedding"], dtype=np.float32)
+        return get_embedding(text, url=self.embedding_model_url, model=self.model_name)
 
     def add(self, item: MemoryItem):
-        emb = self._get_embedding(item.text)
-        self.embeddings.append(emb)
-        self.data.append(item)
+        self._add_embedded([item], self._get_embedding(item.text).reshape(1, -1))
 
-        # Initialize or add to index
+    @_locked
+    def _add_embedded(self, items: List[MemoryItem], vectors: np.ndarray):
+        # The vectors live only in the index (and the store, if persistent)
+        first = len(self.data)
+        if self.store is not None:
+            self.store.append([item.model_dump_json() for item in items], vectors, self.model_name)
         if self.index is None:
-            self.index = faiss.IndexFlatL2(len(emb))
-        self.index.add(np.stack([emb]))
+            self.index = make_index(vectors.shape[1], self.index_config)
+        add_vectors(self.index, vectors, np.arange(first, first + len(items)), self.index_config)
+        self.data.extend(items)
+        self.live += len(items)
+        for item_id, item in enumerate(items, start=first):
+            self._index_attributes(item_id, item)
+        self.index = conform(self.index, self.index_config)
+        self._apply_retention(items)
+        if len(self.data) - self._snapshot_at[0] >= self.snapshot_every:
+            self.snapshot()
+
+    def _index_attributes(self, item_id: int, item: MemoryItem):
+        self.by_type[item.type][item_id] = None
+        if item.session_id is not None:
+            self.by_session[item.session_id][item_id] = None
+        for tag in set(item.tags):
+            self.by_tag[tag][item_id] = None
+
+    @_locked
+    def forget(self, ids: Iterable[int]):
+        """Remove memories by id."""
+        ids = np.array(sorted({i for i in ids if 0 <= i < len(self.data) and self.data[i] is not None}), dtype=np.int64)
+        if not len(ids):
+            return
+        if self.store is not None:
+            self.store.delete(ids)
+            self._deletions += len(ids)
+        self._drop_from_index(ids)
+        for item_id in ids.tolist():
+            item = self.data[item_id]
+            self._unindex(self.by_type, item.type, item_id)
+            if item.session_id is not None:
+                self._unindex(self.by_session, item.session_id, item_id)
+            for tag in set(item.tags):
+                self._unindex(self.by_tag, tag, item_id)
+            self.data[item_id] = None
+        self.live -= len(ids)
+        dead = len(self.data) - self.live
+        if dead >= COMPACT_MIN_DEAD and dead > self.live:
+            self.compact()
+
+    def _drop_from_index(self, ids: np.ndarray):
+        """Take forgotten ids out of search results.
+
+        Flat and IVF indexes delete in place. HNSW would rebuild its whole
+        graph per call, so there ids are only marked dead (searches skip them)
+        until they reach HNSW_REBUILD_DEAD_SHARE of the graph; then it is
+        rebuilt once without all of them.
+        """
+        if not len(ids):
+            return
+        if index_kind(self.index) != "hnsw":
+            self.index = remove_ids(self.index, ids, self.index_config)
+            return
+        self._dead_in_index.update(ids.tolist())
+        self._skip_dead = None
+        if len(self._dead_in_index) >= HNSW_REBUILD_DEAD_SHARE * self.index.ntotal:
+            dead = np.fromiter(self._dead_in_index, dtype=np.int64, count=len(self._dead_in_index))
+            self.index = remove_ids(self.index, dead, self.index_config)
+            self._dead_in_index.clear()
+
+    def _live_selector(self) -> Optional[faiss.IDSelector]:
+        if not self._dead_in_index:
+            return None
+        if self._skip_dead is None:
+            dead = np.fromiter(self._dead_in_index, dtype=np.int64, count=len(self._dead_in_index))
+            batch = faiss.IDSelectorBatch(len(dead), faiss.swig_ptr(dead))
+            self._skip_dead = (faiss.IDSelectorNot(batch), batch)  # the batch must outlive the Not
+        return self._skip_dead[0]
+
+    @staticmethod
+    def _unindex(postings: Dict[str, Dict[int, None]], key: str, item_id: int):
+        ids = postings[key]
+        ids.pop(item_id, None)
+        if not ids:
+            del postings[key]  # finished sessions shouldn't pile up
+
+    def _apply_retention(self, added: List[MemoryItem]):
+        policy = self.retention
+        doomed = set()
+
+        # Ids are in insertion order, so expired memories form a prefix of each type's list
+        now = datetime.now()
+        for kind, seconds in policy.ttl.items():
+            cutoff = now - timedelta(seconds=seconds)
+            for item_id in self.by_type.get(kind, {}):
+                timestamp = self.data[item_id].timestamp
+                if timestamp is None or datetime.fromisoformat(timestamp) >= cutoff:
+                    break
+                doomed.add(item_id)
+
+        if policy.max_per_session is not None:
+            for session in {item.session_id for item in added if item.session_id is not None}:
+                ids = [i for i in self.by_session[session] if i not in doomed]
+                if len(ids) > policy.max_per_session:
+                    doomed.update(ids[: len(ids) - int(policy.max_per_session * policy.evict_to)])
+
+        if policy.max_items is not None and self.live - len(doomed) > policy.max_items:
+            excess = self.live - len(doomed) - int(policy.max_items * policy.evict_to)
+            item_id = self._oldest
+            while excess > 0 and item_id < len(self.data):
+                if self.data[item_id] is not None and item_id not in doomed:
+                    doomed.add(item_id)
+                    excess -= 1
+                item_id += 1
+
+        self.forget(doomed)
+        while self._oldest < len(self.data) and self.data[self._oldest] is None:
+            self._oldest += 1
+
+        if policy.merge_threshold is not None:
+            groups = {(item.session_id, item.tool_name) for item in added if item.type == "tool_output"}
+            if groups:
+                self.consolidate(groups)
+
+    @_locked
+    def consolidate(self, groups: Optional[set] = None):
+        """Merge near-duplicate tool_output memories, keeping the newest of each cluster.
+
+        Memories are compared within their (session_id, tool_name) group only;
+        groups limits the pass to those keys, otherwise every group is checked.
+        """
+        threshold = self.retention.merge_threshold
+        if threshold is None or self.index is None:
+            return
+        members: Dict[tuple, List[int]] = defaultdict(list)
+        for item_id in self.by_type.get("tool_output", {}):
+            item = self.data[item_id]
+            key = (item.session_id, item.tool_name)
+            if groups is None or key in groups:
+                members[key].append(item_id)
+
+        doomed = []
+        for ids in members.values():
+            if len(ids) < 2:
+                continue
+            ids = np.array(ids[::-1], dtype=np.int64)  # newest first
+            similar = similarity_matrix(self.index.reconstruct_batch(ids)) >= threshold
+            merged = np.zeros(len(ids), dtype=bool)
+            for i in range(len(ids)):
+                if merged[i]:
+                    continue
+                # Older memories close to this one collapse into it
+                duplicates = similar[i].copy()
+                duplicates[: i + 1] = False
+                merged |= duplicates
+            doomed.extend(ids[merged].tolist())
+        self.forget(doomed)
+
+    @_locked
+    def compact(self):
+        """Renumber live memories densely, dropping forgotten slots from RAM and disk."""
+        live = [i for i, item in enumerate(self.data) if item is not None]
+        items = [self.data[i] for i in live]
+        if self.store is not None:
+            _, stored = self.store.load()
+            vectors = np.ascontiguousarray(stored[live]) if live else np.empty((0, stored.shape[1]), dtype=np.float32)
+            self.store.rewrite([item.model_dump_json() for item in items], vectors)
+        elif self.index is not None:
+            ids, exported = export_vectors(self.index)
+            order = np.argsort(ids)
+            # An HNSW index may still hold forgotten ids (see _drop_from_index)
+            vectors = exported[order][np.isin(ids[order], live)]
+        self._reset()
+        if items:
+            self.index = make_index(vectors.shape[1], self.index_config, training=vectors)
+            add_vectors(self.index, vectors, np.arange(len(items)), self.index_config)
+            self.index = conform(self.index, self.index_config)
+            self.data = items
+            self.live = len(items)
+            for item_id, item in enumerate(items):
+                self._index_attributes(item_id, item)
+            self.snapshot()
+
+    def _matching_ids(
+        self,
+        type_filter: Optional[str],
+        tag_filter: Optional[List[str]],
+        session_filter: Optional[str]
+    ) -> Optional[np.ndarray]:
+        """Sorted ids passing every filter (any of the tags), or None when nothing is filtered."""
+        candidates = None
+        # Smallest list first keeps the intersections cheap
+        lists = []
+        if session_filter:
+            lists.append(np.fromiter(self.by_session.get(session_filter, {}), dtype=np.int64))
+        if type_filter:
+            lists.append(np.fromiter(self.by_type.get(type_filter, {}), dtype=np.int64))
+        if tag_filter:
+            tagged = [np.fromiter(self.by_tag.get(tag, {}), dtype=np.int64) for tag in tag_filter]
+            lists.append(np.unique(np.concatenate(tagged)) if tagged else np.empty(0, dtype=np.int64))
+        for ids in sorted(lists, key=len):
+            candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+        return candidates
 
     def retrieve(
         self,
@@ -52,36 +362,47 @@ class MemoryManager:
         tag_filter: Optional[List[str]] = None,
         session_filter: Optional[str] = None
     ) -> List[MemoryItem]:
-        if not self.index or len(self.data) == 0:
+        if not self.index or self.live == 0:
             return []
 
-        query_vec = self._get_embedding(query).reshape(1, -1)
-        D, I = self.index.search(query_vec, top_k * 2)  # Overfetch to allow filtering
+        query_vec = embed_query(query, url=self.embedding_model_url, model=self.model_name).reshape(1, -1)
+        return self._search(query_vec, top_k, type_filter, tag_filter, session_filter)
 
-        results = []
-        for idx in I[0]:
-            if idx >= len(self.data):
-                continue
-            item = self.data[idx]
-
-            # Filter by type
-            if type_filter and item.type != type_filter:
-                continue
-
-            # Filter by tags
-            if tag_filter and not any(tag in item.tags for tag in tag_filter):
-                continue
-
-            # Filter by session
-            if session_filter and item.session_id != session_filter:
-                continue
-
-            results.append(item)
-            if len(results) >= top_k:
-                break
+    @_locked
+    def _search(
+        self,
+        query_vec: np.ndarray,
+        top_k: int,
+        type_filter: Optional[str],
+        tag_filter: Optional[List[str]],
+        session_filter: Optional[str]
+    ) -> List[MemoryItem]:
+        if not self.index or self.live == 0:
+            return []
+        # A persistent store keeps float32 vectors, so reduced-precision codes only need to shortlist
+        refine = self.store is not None and index_storage(self.index) != "float32"
+        fetch = top_k * RERANK_FACTOR if refine else top_k
+        candidates = self._matching_ids(type_filter, tag_filter, session_filter)
+        if candidates is None:
+            D, I = self.index.search(query_vec, fetch, params=search_params(self.index, sel=self._live_selector()))
+            ids = I[0][I[0] >= 0]
+        elif len(candidates) == 0:
+            return []
+        else:
+            # Filters are applied inside the search, so top_k matches come back however rare they are
+            D, ids = search_subset(self.index, query_vec, candidates, fetch)
+        if refine and len(ids):
+            stored = self.store.vectors(len(self.data))
+            _, ids = rerank(query_vec, ids, prepare_vectors(stored[ids], self.index_config), top_k,
+                            self.index.metric_type)
 
-        return results
+        return [self.data[idx] for idx in ids if 0 <= idx < len(self.data) and self.data[idx] is not None]
 
     def bulk_add(self, items: List[MemoryItem]):
-        for item in items:
-            self.add(item)
+        """Embed items in concurrent batches and add them to the index in one call."""
+        items = list(items)
+        if not items:
+            return
+        vectors = embed_texts([item.text for item in items], url=self.embedding_model_url,
+                              model=self.model_name, desc="Embedding memories")
+        self._add_embedded(items, vectors)
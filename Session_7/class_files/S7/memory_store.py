@@ -0,0 +1,183 @@
+# memory_store.py
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from file_lock import FileLock
+
+ITEMS_FILE = "items.jsonl"
+VECTORS_FILE = "vectors.f32"
+META_FILE = "meta.json"
+INDEX_FILE = "index.bin"
+INDEX_META_FILE = "index.json"
+DELETED_FILE = "deleted.i64"
+
+
+class MemoryStore:
+    """Durable backing for MemoryManager.
+
+    items.jsonl is an append-only log with one MemoryItem per line; line i is
+    memory id i. vectors.f32 holds the matching float32 embeddings back to
+    back and is memory-mapped on load, so nothing is re-embedded. Forgotten
+    memories are appended to deleted.i64 as int64 ids; rewrite() drops them
+    for good. index.bin is a periodic snapshot of the FAISS index together
+    with how many items and deletions it covers; on load only what happened
+    after the snapshot is replayed.
+
+    Vectors are written before their log line, so a crash mid-append leaves at
+    most a torn tail, which load() trims.
+
+    Ids come from the line count this process has seen, so only one process
+    may open a store at a time: the constructor takes an exclusive lock on
+    <directory>.lock (next to the directory, so rewrite() keeps it) and raises
+    RuntimeError if it is already held. close() releases it.
+    """
+
+    def __init__(self, directory: Path, lock: bool = True):
+        self.directory = Path(directory)
+        self._owner: Optional[FileLock] = None
+        if lock:
+            self._owner = FileLock(self.directory.with_name(self.directory.name + ".lock"))
+            if not self._owner.acquire(blocking=False):
+                self._owner = None
+                raise RuntimeError(f"Memory at {self.directory} is already open in another process or "
+                                   f"MemoryManager; close that one or give this one its own path")
+        self._recover()
+        self.items_path = self.directory / ITEMS_FILE
+        self.vectors_path = self.directory / VECTORS_FILE
+        self.meta_path = self.directory / META_FILE
+        self.index_path = self.directory / INDEX_FILE
+        self.index_meta_path = self.directory / INDEX_META_FILE
+        self.deleted_path = self.directory / DELETED_FILE
+        self.dim: Optional[int] = None
+        self.model: Optional[str] = None
+        self._map: Optional[np.ndarray] = None
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text())
+            self.dim, self.model = meta["dim"], meta["model"]
+
+    def _rewrite_paths(self) -> Tuple[Path, Path]:
+        return self.directory.with_name(self.directory.name + ".rewrite"), \
+            self.directory.with_name(self.directory.name + ".old")
+
+    def _recover(self) -> None:
+        """Finish a rewrite() that crashed between its two directory renames."""
+        fresh, old = self._rewrite_paths()
+        if not self.directory.exists() and fresh.exists() and old.exists():
+            os.replace(fresh, self.directory)
+        if self.directory.exists():
+            shutil.rmtree(fresh, ignore_errors=True)
+            shutil.rmtree(old, ignore_errors=True)
+
+    def close(self) -> None:
+        if self._owner is not None:
+            self._owner.release()
+            self._owner = None
+
+    def _init_meta(self, dim: int, model: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim, self.model = dim, model
+        self.meta_path.write_text(json.dumps({"dim": dim, "model": model}))
+
+    def deleted(self) -> np.ndarray:
+        """Ids of forgotten memories, in the order they were forgotten."""
+        if not self.deleted_path.exists():
+            return np.empty(0, dtype=np.int64)
+        data = self.deleted_path.read_bytes()
+        return np.frombuffer(data[: len(data) - len(data) % 8], dtype=np.int64)
+
+    def load(self) -> Tuple[List[str], np.ndarray]:
+        """Return (item JSON lines, read-only vector matrix) for every complete record, forgotten ones included."""
+        if self.dim is None or not self.items_path.exists():
+            return [], np.empty((0, self.dim or 0), dtype=np.float32)
+        raw = self.items_path.read_bytes()
+        complete = raw[: raw.rfind(b"\n") + 1]  # a line without its newline was cut off mid-write
+        lines = complete.decode("utf-8").split("\n")[:-1]
+        row_bytes = self.dim * 4
+        rows = self.vectors_path.stat().st_size // row_bytes if self.vectors_path.exists() else 0
+        count = min(len(lines), rows)
+        if len(complete) != len(raw) or count != len(lines) or count * row_bytes != self.vectors_path.stat().st_size:
+            self._truncate(lines[:count], count)
+            lines = lines[:count]
+        if count == 0:
+            return [], np.empty((0, self.dim), dtype=np.float32)
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        return lines, vectors
+
+    def vectors(self, count: int) -> np.ndarray:
+        """Read-only map of the first count vectors, reused until the store grows past it."""
+        if self._map is None or len(self._map) < count:
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        return self._map
+
+    def _truncate(self, lines: List[str], count: int) -> None:
+        with open(self.items_path, "r+b") as f:
+            f.truncate(sum(len(line.encode("utf-8")) + 1 for line in lines))
+        with open(self.vectors_path, "r+b") as f:
+            f.truncate(count * self.dim * 4)
+
+    def append(self, lines: List[str], vectors: np.ndarray, model: str) -> None:
+        """Durably append items (as JSON lines) and their vectors."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self._init_meta(vectors.shape[1], model)
+        elif vectors.shape[1] != self.dim or model != self.model:
+            raise ValueError(f"Memory at {self.directory} holds {self.dim}-dim {self.model} embeddings, "
+                             f"got {vectors.shape[1]}-dim {model}")
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.items_path, "ab") as f:
+            f.write("".join(line + "\n" for line in lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def delete(self, ids: np.ndarray) -> None:
+        """Durably record ids as forgotten."""
+        with open(self.deleted_path, "ab") as f:
+            f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def rewrite(self, lines: List[str], vectors: np.ndarray) -> None:
+        """Replace the whole store with lines and vectors, dropping forgotten memories and the snapshot.
+
+        The new store is built next to this one and swapped in with two
+        renames; a crash in between is finished by the next constructor.
+        """
+        fresh, old = self._rewrite_paths()
+        shutil.rmtree(fresh, ignore_errors=True)
+        self._map = None
+        staged = MemoryStore(fresh, lock=False)  # covered by this store's lock
+        staged._init_meta(self.dim, self.model)
+        if lines:
+            staged.append(lines, vectors, self.model)
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(self.directory, old)
+        os.replace(fresh, self.directory)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def save_index(self, index: faiss.Index, items: int, deleted: int) -> None:
+        """Snapshot index, which covers the first `items` memories and first `deleted` deletions."""
+        tmp = self.index_path.with_suffix(".tmp")
+        faiss.write_index(index, str(tmp))
+        os.replace(tmp, self.index_path)
+        self.index_meta_path.write_text(json.dumps({"items": items, "deleted": deleted, "ntotal": index.ntotal}))
+
+    def load_index(self) -> Tuple[Optional[faiss.Index], int, int]:
+        """The last snapshot and how many memories and deletions it covers, or (None, 0, 0)."""
+        if not (self.index_path.exists() and self.index_meta_path.exists()):
+            return None, 0, 0
+        index = faiss.read_index(str(self.index_path))
+        meta = json.loads(self.index_meta_path.read_text())
+        if meta.get("ntotal") != index.ntotal:
+            # index.bin was replaced but the crash came before index.json; rebuild from the vectors
+            return None, 0, 0
+        return index, meta["items"], meta["deleted"]
@@ -0,0 +1,166 @@
+# metadata_store.py
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+BLOB_FILE = "chunks.bin"
+OFFSETS_FILE = "offsets.bin"
+VECTORS_FILE = "vectors.f32"
+_SLOT = struct.Struct("<qq")  # (offset, length) of a record in chunks.bin
+
+
+def _trim_torn_tail(path: Path, unit: int) -> None:
+    """Cut path back to a whole number of unit-sized entries.
+
+    A crash or a full disk mid-append can leave a partial entry at the end;
+    appending after it would shift every later entry off its id. The bytes
+    cut are past every entry any generation reads, so this is safe on files
+    hard-linked into older generations too.
+    """
+    if path.exists():
+        size = path.stat().st_size
+        if size % unit:
+            os.truncate(path, size - size % unit)
+
+
+class MetadataStore:
+    """Chunk metadata addressed by chunk id, stored as two flat files.
+
+    chunks.bin is an append-only run of UTF-8 JSON records; offsets.bin is a
+    fixed-width array of (offset, length) pairs where slot i belongs to chunk
+    id i. Looking up a record costs one seek into each file, so fetching the
+    k search hits is O(k) however large the corpus grows. Appending new chunks
+    never rewrites existing data; records of removed chunks stay behind until
+    rewrite() is called by compaction.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.blob_path = self.directory / BLOB_FILE
+        self.offsets_path = self.directory / OFFSETS_FILE
+
+    def exists(self) -> bool:
+        return self.offsets_path.exists() and self.blob_path.exists()
+
+    def __len__(self) -> int:
+        """Number of id slots, i.e. one past the highest chunk id stored."""
+        return self.offsets_path.stat().st_size // _SLOT.size if self.offsets_path.exists() else 0
+
+    def get_many(self, ids: Iterable[int]) -> List[Optional[dict]]:
+        """Records for ids, with None for ids that have no record."""
+        ids = list(ids)
+        if not self.exists():
+            return [None] * len(ids)
+        results: List[Optional[dict]] = []
+        with open(self.offsets_path, "rb") as offsets, open(self.blob_path, "rb") as blob:
+            slots = os.fstat(offsets.fileno()).st_size // _SLOT.size
+            for chunk_id in ids:
+                if not 0 <= chunk_id < slots:
+                    results.append(None)
+                    continue
+                offsets.seek(chunk_id * _SLOT.size)
+                offset, length = _SLOT.unpack(offsets.read(_SLOT.size))
+                if length == 0:
+                    results.append(None)
+                    continue
+                blob.seek(offset)
+                results.append({"id": chunk_id, **json.loads(blob.read(length))})
+        return results
+
+    def append(self, records: Dict[int, dict]) -> None:
+        """Store records for new chunk ids. Ids must not already have a slot; skipped ids get empty slots."""
+        if not records:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _trim_torn_tail(self.offsets_path, _SLOT.size)
+        first = len(self)
+        if min(records) < first:
+            raise ValueError(f"Chunk id {min(records)} already has a slot (store holds {first})")
+        with open(self.blob_path, "ab") as blob, open(self.offsets_path, "ab") as offsets:
+            offset = blob.tell()
+            slots = bytearray()
+            for chunk_id in range(first, max(records) + 1):
+                record = records.get(chunk_id)
+                if record is None:
+                    slots += _SLOT.pack(0, 0)
+                    continue
+                data = json.dumps({k: v for k, v in record.items() if k != "id"}, ensure_ascii=False).encode("utf-8")
+                blob.write(data)
+                slots += _SLOT.pack(offset, len(data))
+                offset += len(data)
+            # Records first, then the slots that point at them
+            blob.flush()
+            os.fsync(blob.fileno())
+            offsets.write(slots)
+            offsets.flush()
+            os.fsync(offsets.fileno())
+
+    def rewrite(self, records: Dict[int, dict]) -> None:
+        """Replace the whole store with records, dropping everything else."""
+        staging = MetadataStore(self.directory / ".metadata_rewrite")
+        staging.directory.mkdir(parents=True, exist_ok=True)
+        for path in (staging.blob_path, staging.offsets_path):
+            path.unlink(missing_ok=True)
+        staging.append(records)
+        staging.blob_path.touch()
+        staging.offsets_path.touch()
+        os.replace(staging.blob_path, self.blob_path)
+        os.replace(staging.offsets_path, self.offsets_path)
+        staging.directory.rmdir()
+
+    def import_json(self, path: Path) -> int:
+        """Convert a legacy metadata.json (list of chunk dicts) into this store. Returns the record count."""
+        entries = json.loads(Path(path).read_text())
+        records = {entry.get("id", i): entry for i, entry in enumerate(entries)}
+        self.rewrite(records)
+        return len(records)
+
+
+class VectorStore:
+    """Full-precision vectors addressed by chunk id: row i of vectors.f32 belongs to chunk id i.
+
+    Reads go through a memory map, so only the rows actually touched (e.g.
+    the candidates being reranked) are paged in. Like chunks.bin it is only
+    ever appended to; ids without a vector get a zero row.
+    """
+
+    def __init__(self, directory: Path, dim: int):
+        self.directory = Path(directory)
+        self.path = self.directory / VECTORS_FILE
+        self.dim = dim
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def __len__(self) -> int:
+        return self.path.stat().st_size // (self.dim * 4) if self.path.exists() else 0
+
+    def get(self, ids: np.ndarray) -> Optional[np.ndarray]:
+        """Vectors for ids, or None if any id is past the end of the file."""
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = len(self)
+        if not len(ids) or ids.max() >= rows:
+            return None
+        return np.array(np.memmap(self.path, dtype=np.float32, mode="r", shape=(rows, self.dim))[ids])
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Write vectors for new ids, which must all be at or past the current end."""
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        _trim_torn_tail(self.path, self.dim * 4)
+        first = len(self)
+        if ids.min() < first:
+            raise ValueError(f"Chunk id {ids.min()} already has a vector (store holds {first})")
+        block = np.zeros((ids.max() + 1 - first, self.dim), dtype=np.float32)
+        block[ids - first] = vectors
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
@@ -1,9 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional, List
-import os
-from dotenv import load_dotenv
-from google import genai
 import re
+from llm import get_llm
 
 # Optional: import log from agent if shared, else define locally
 try:
@@ -14,11 +12,6 @@ except ImportError:
         now = datetime.datetime.now().strftime("%H:%M:%S")
         print(f"[{now}] [{stage}] {msg}")
 
-load_dotenv()
-
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-
 class PerceptionResult(BaseModel):
     user_input: str
     intent: Optional[str]
@@ -26,7 +19,7 @@ class PerceptionResult(BaseModel):
     tool_hint: Optional[str] = None
 
 
-def extract_perception(user_input: str) -> PerceptionResult:
+async def extract_perception(user_input: str) -> PerceptionResult:
     """Extracts intent, entities, and tool hints using LLM"""
 
     prompt = f"""
@@ -43,11 +36,7 @@ Output only the dictionary on a single line. Do NOT wrap it in ```json or other
     """
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        raw = response.text.strip()
+        raw = await get_llm().generate(prompt, stage="perception")
         log("perception", f"LLM output: {raw}")
 
         # Strip Markdown backticks if present
@@ -68,4 +57,4 @@ Output only the dictionary on a single line. Do NOT wrap it in ```json or other
 
     except Exception as e:
         log("perception", f"⚠️ Extraction failed: {e}")
-        return PerceptionResult(user_input=user_input)
+        return PerceptionResult(user_input=user_input, intent=None)
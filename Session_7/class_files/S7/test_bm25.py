@@ -0,0 +1,42 @@
+# test_bm25.py
+
+from bm25 import BM25Index, exact_terms, reciprocal_rank_fusion
+
+
+def index(*texts):
+    bm25 = BM25Index()
+    for i, text in enumerate(texts):
+        bm25.add(i, text)
+    return bm25
+
+
+def test_search_ranks_rare_terms_and_frequency_higher():
+    bm25 = index("the cat sat", "the dog sat", "the cat chased the cat", "the end")
+
+    assert [i for i, _ in bm25.search("cat")] == [2, 0]
+    assert bm25.search("dog the")[0][0] == 1
+    assert bm25.search("giraffe") == []
+    assert len(bm25.search("the", k=2)) == 2
+
+
+def test_removed_chunks_are_not_returned(tmp_path):
+    bm25 = index("invoice INV42 paid", "invoice INV43 due", "weather report")
+
+    bm25.remove([0])
+
+    assert [i for i, _ in bm25.search("invoice")] == [1]
+    assert not bm25.contains("inv42") and bm25.contains("inv43")
+    bm25.save(tmp_path / "bm25.json")
+    loaded = BM25Index.load(tmp_path / "bm25.json")
+    assert loaded.search("invoice") == bm25.search("invoice")
+    assert "inv42" not in loaded.postings
+
+
+def test_exact_terms_are_quoted_words_and_identifiers():
+    assert exact_terms('total for INVG67564 from "Acme Corp"') == ["acme", "corp", "invg67564"]
+    assert exact_terms("what is 42 plus 7") == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    assert reciprocal_rank_fusion([[1, 2, 3], [2, 4, 5]], k=3) == [2, 1, 4]
+    assert reciprocal_rank_fusion([[5], []], k=5) == [5]
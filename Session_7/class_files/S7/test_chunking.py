@@ -0,0 +1,43 @@
+# test_chunking.py
+
+from chunking import chunk_text, count_tokens
+
+P1, P2, P3 = "alpha beta gamma delta", "one two three four", "red green blue black"  # 4 tokens each
+
+
+def test_paragraphs_are_packed_whole():
+    text = f"{P1}\n\n{P2}\n\n{P3}\n"
+
+    assert list(chunk_text(text, max_tokens=10, overlap_tokens=0)) == [f"{P1}\n\n{P2}", P3]
+    assert list(chunk_text(text, max_tokens=12, overlap_tokens=0)) == [f"{P1}\n\n{P2}\n\n{P3}"]
+
+
+def test_trailing_blocks_overlap_into_next_chunk():
+    text = f"{P1}\n\n{P2}\n\n{P3}\n"
+
+    assert list(chunk_text(text, max_tokens=10, overlap_tokens=4)) == [f"{P1}\n\n{P2}", f"{P2}\n\n{P3}"]
+    # Overlap never pushes a chunk past the budget
+    assert list(chunk_text(text, max_tokens=8, overlap_tokens=4)) == [f"{P1}\n\n{P2}", f"{P2}\n\n{P3}"]
+    assert list(chunk_text(text, max_tokens=7, overlap_tokens=4)) == [P1, P2, P3]
+
+
+def test_headings_start_a_chunk_and_code_fences_stay_whole():
+    code = "```\nx = 1\n\ny = 2\n```"
+    text = f"# Intro\n{P1}\n\n## Code\n{code}\n"
+
+    chunks = list(chunk_text(text, max_tokens=20, overlap_tokens=0))
+
+    assert chunks == [f"# Intro\n\n{P1}", f"## Code\n\n{code}"]
+    # Below a quarter of the budget the next section joins the current chunk
+    assert len(list(chunk_text(text, max_tokens=100, overlap_tokens=0))) == 1
+
+
+def test_oversized_block_is_windowed_with_overlap():
+    words = [f"w{i}" for i in range(25)]
+
+    chunks = list(chunk_text(" ".join(words), max_tokens=10, overlap_tokens=3))
+
+    assert all(count_tokens(chunk) <= 10 for chunk in chunks)
+    assert chunks[0].split() == words[:10]
+    assert chunks[1].split()[:3] == words[7:10]
+    assert chunks[-1].split()[-1] == words[-1]
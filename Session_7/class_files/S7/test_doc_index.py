@@ -0,0 +1,229 @@
+# test_doc_index.py
+
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+from bm25 import BM25Index
+from doc_index import (BM25_FILE, DOC_CACHE_FILE, INDEX_FILE, LEGACY_METADATA_FILE, MANIFEST_FILE, IndexManager,
+                       new_doc_cache)
+from file_lock import FileLock
+from metadata_store import OFFSETS_FILE, MetadataStore, VectorStore
+from vector_index import IndexConfig, add_vectors, make_index
+
+DIM = 4
+CONFIG = IndexConfig()
+
+
+def embed(text: str) -> np.ndarray:
+    """Deterministic stand-in for the embedding server."""
+    rng = np.random.default_rng(sum(map(ord, text)))
+    return rng.random(DIM, dtype=np.float32)
+
+
+def write_generation(staged, records, append=False):
+    """Fill a staging directory the way save_index() does; returns (index, bm25)."""
+    store = MetadataStore(staged)
+    store.append(records) if append else store.rewrite(records)
+    ids = np.arange(len(store), dtype=np.int64)
+    index = make_index(DIM, CONFIG)
+    add_vectors(index, np.stack([embed(str(i)) for i in ids]), ids, CONFIG)
+    bm25 = BM25Index()
+    for chunk_id, record in store_records(store).items():
+        bm25.add(chunk_id, record["chunk"])
+    bm25.save(staged / BM25_FILE)
+    faiss.write_index(index, str(staged / INDEX_FILE))
+    (staged / DOC_CACHE_FILE).write_text(json.dumps(new_doc_cache()))
+    return index, bm25
+
+
+def store_records(store):
+    return {r["id"]: r for r in store.get_many(range(len(store))) if r is not None}
+
+
+def record(text):
+    return {"doc": "a.txt", "chunk": text, "chunk_id": text}
+
+
+def publish(manager, records, **stage_args):
+    with manager.writing():
+        with manager.stage(**stage_args) as staged:
+            index, bm25 = write_generation(staged, records, append=stage_args.get("carry_metadata", True))
+        manager.publish(index, bm25)
+
+
+def test_stage_publishes_generation(tmp_path):
+    manager = IndexManager(tmp_path)
+    publish(manager, {0: record("apples are red")}, carry_metadata=False)
+
+    assert manager.read_manifest()["directory"] == "gen-000001"
+    assert manager.current().generation == 1
+    assert [hit["chunk"] for hit in manager.search("apples", embed, mode="keyword")] == ["apples are red"]
+
+
+def test_failure_mid_stage_keeps_current_generation(tmp_path):
+    manager = IndexManager(tmp_path)
+    publish(manager, {0: record("apples are red")}, carry_metadata=False)
+
+    with pytest.raises(RuntimeError):
+        with manager.stage() as staged:
+            MetadataStore(staged).append({1: record("half written")})
+            raise RuntimeError("embedding server went away")
+
+    assert manager.read_manifest()["directory"] == "gen-000001"
+    assert sorted(p.name for p in tmp_path.iterdir() if not p.name.startswith(".")) == [MANIFEST_FILE, "gen-000001"]
+    # A fresh reader (e.g. another server process) still sees the old generation
+    reader = IndexManager(tmp_path)
+    assert [hit["chunk"] for hit in reader.search("apples", embed, mode="keyword")] == ["apples are red"]
+
+    # The slot the failed run used stays taken; the next run appends after it
+    assert len(manager.metadata) == 2
+    publish(manager, {2: record("pears are green")})
+    assert manager.read_manifest()["directory"] == "gen-000002"
+    assert [hit["id"] for hit in manager.search("pears", embed, mode="keyword")] == [2]
+
+
+def test_stage_cleans_up_after_crash(tmp_path):
+    manager = IndexManager(tmp_path)
+    publish(manager, {0: record("apples are red")}, carry_metadata=False)
+    # Killed after the staging rename but before the manifest write, and mid-stage on an earlier attempt
+    (tmp_path / "gen-000002").mkdir()
+    (tmp_path / "gen-000002" / "junk").write_text("x")
+    (tmp_path / ".staging-000002").mkdir()
+
+    publish(manager, {1: record("pears are green")})
+
+    assert manager.read_manifest()["directory"] == "gen-000002"
+    assert not (tmp_path / "gen-000002" / "junk").exists()
+    assert not (tmp_path / ".staging-000002").exists()
+    assert [r["chunk"] for r in store_records(manager.metadata).values()] == ["apples are red", "pears are green"]
+
+
+def test_old_generations_are_collected(tmp_path):
+    manager = IndexManager(tmp_path)
+    publish(manager, {0: record("one")}, carry_metadata=False)
+    for i in range(1, 4):
+        publish(manager, {i: record(f"chunk {i}")})
+
+    assert sorted(p.name for p in tmp_path.glob("gen-*")) == ["gen-000003", "gen-000004"]
+
+
+def test_first_publish_removes_legacy_layout(tmp_path):
+    (tmp_path / INDEX_FILE).write_bytes(b"legacy")
+    (tmp_path / LEGACY_METADATA_FILE).write_text(json.dumps([record("apples are red")]))
+    manager = IndexManager(tmp_path)
+    MetadataStore(tmp_path).import_json(tmp_path / LEGACY_METADATA_FILE)
+
+    publish(manager, {0: record("apples are red")}, carry_metadata=False)
+
+    assert not (tmp_path / INDEX_FILE).exists()
+    assert not (tmp_path / LEGACY_METADATA_FILE).exists()
+    assert not (tmp_path / OFFSETS_FILE).exists()
+
+
+def test_exclusive_lock_excludes_second_writer(tmp_path):
+    manager = IndexManager(tmp_path)
+    with manager.exclusive():
+        other = FileLock(tmp_path / ".lock")
+        assert not other.acquire(blocking=False)
+        assert not other.acquire(timeout=0.2)
+    assert other.acquire(blocking=False)
+    other.release()
+
+
+def test_metadata_store_append_and_lookup(tmp_path):
+    store = MetadataStore(tmp_path)
+    store.append({0: record("zero"), 2: record("two")})
+
+    assert len(store) == 3
+    assert [r and r["chunk"] for r in store.get_many([0, 1, 2, 3, -1])] == ["zero", None, "two", None, None]
+    with pytest.raises(ValueError):
+        store.append({2: record("again")})
+
+    store.append({3: {"doc": "b.md", "chunk": "naïve ₹ text", "chunk_id": "b_0"}})
+    assert store.get_many([3]) == [{"id": 3, "doc": "b.md", "chunk": "naïve ₹ text", "chunk_id": "b_0"}]
+
+
+def test_metadata_store_rewrite_replaces_everything(tmp_path):
+    store = MetadataStore(tmp_path)
+    store.append({i: record(f"old {i}") for i in range(5)})
+
+    store.rewrite({0: record("new 0"), 1: record("new 1")})
+
+    assert len(store) == 2
+    assert [r["chunk"] for r in store.get_many([0, 1])] == ["new 0", "new 1"]
+    assert store.get_many([4]) == [None]
+    assert not (tmp_path / ".metadata_rewrite").exists()
+
+    store.rewrite({})
+    assert store.exists() and len(store) == 0
+
+
+def test_metadata_store_trims_torn_tail(tmp_path):
+    store = MetadataStore(tmp_path)
+    store.append({0: record("zero"), 1: record("one")})
+    with open(store.offsets_path, "ab") as f:
+        f.write(b"\x01\x02\x03")  # a slot cut short by a crash
+    with open(store.blob_path, "ab") as f:
+        f.write(b'{"doc": "trunc')  # a record whose slot was never written
+
+    store.append({2: record("two")})
+
+    assert [r["chunk"] for r in store.get_many([0, 1, 2])] == ["zero", "one", "two"]
+
+
+def test_metadata_store_imports_legacy_json(tmp_path):
+    legacy = tmp_path / LEGACY_METADATA_FILE
+    legacy.write_text(json.dumps([record("zero"), record("one")]))
+    store = MetadataStore(tmp_path)
+
+    assert store.import_json(legacy) == 2
+    assert [r["chunk"] for r in store.get_many([0, 1])] == ["zero", "one"]
+
+
+def test_vector_store_append_gaps_and_torn_tail(tmp_path):
+    store = VectorStore(tmp_path, DIM)
+    store.append(np.array([0, 2]), np.ones((2, DIM), dtype=np.float32))
+    with open(store.path, "ab") as f:
+        f.write(b"\x00" * 5)
+
+    store.append(np.array([3]), np.full((1, DIM), 3, dtype=np.float32))
+
+    assert len(store) == 4
+    np.testing.assert_array_equal(store.get(np.array([0, 1, 2, 3]))[:, 0], [1, 0, 1, 3])
+    assert store.get(np.array([4])) is None
+    with pytest.raises(ValueError):
+        store.append(np.array([3]), np.zeros((1, DIM), dtype=np.float32))
+
+
+def no_embed(text: str) -> np.ndarray:
+    raise AssertionError("embedding should have been skipped")
+
+
+def test_hybrid_search_fuses_vector_and_keyword(tmp_path):
+    manager = IndexManager(tmp_path)
+    publish(manager, {i: record(text) for i, text in enumerate(["apples are red", "pears are green", "sky"])},
+            carry_metadata=False)
+
+    hits = [hit["chunk"] for hit in manager.search("pears", embed, k=3)]
+
+    assert hits[0] == "pears are green" and sorted(hits) == ["apples are red", "pears are green", "sky"]
+
+
+def test_hybrid_search_answers_exact_identifiers_from_bm25(tmp_path):
+    manager = IndexManager(tmp_path)
+    publish(manager, {0: record("invoice INV4711 paid"), 1: record("invoice INV4712 due")}, carry_metadata=False)
+
+    assert [hit["id"] for hit in manager.search("status of INV4712", no_embed)] == [1]
+    with pytest.raises(AssertionError, match="skipped"):
+        manager.search("status of INV9999", no_embed)  # not in the corpus: falls back to hybrid
+
+
+def test_search_rejects_k_below_one(tmp_path):
+    manager = IndexManager(tmp_path)
+    publish(manager, {0: record("apples are red")}, carry_metadata=False)
+
+    with pytest.raises(ValueError, match="k must be at least 1"):
+        manager.search("apples", embed, k=0)
@@ -0,0 +1,46 @@
+# test_ingest.py
+
+import os
+import time
+
+import pytest
+
+from ingest import convert_files
+
+
+def write(path, text):
+    path.write_text(text)
+    return path
+
+
+def test_convert_files_yields_chunks_and_errors(tmp_path):
+    first = write(tmp_path / "a.md", "# Apples\n\nApples are red and grow on trees.")
+    second = write(tmp_path / "b.txt", "Pears are green.")
+    missing = tmp_path / "missing.txt"
+
+    results = {r.path: r for r in convert_files([first, second, missing], workers=2, timeout=60)}
+
+    assert set(results) == {first, second, missing}
+    assert "Apples are red" in " ".join(results[first].chunks)
+    assert results[second].chunks == ["Pears are green."] and results[second].error is None
+    assert results[missing].chunks is None and results[missing].error
+
+
+def test_convert_files_with_nothing_to_do():
+    assert list(convert_files([])) == []
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs a FIFO to stall the converter")
+def test_stuck_file_times_out_and_worker_is_replaced(tmp_path):
+    # Reading a FIFO nobody writes to blocks forever, like a pathological PDF
+    stuck = tmp_path / "stuck.txt"
+    os.mkfifo(stuck)
+    after = write(tmp_path / "after.txt", "Converted by the replacement worker.")
+
+    start = time.monotonic()
+    results = {r.path: r for r in convert_files([stuck, after], workers=1, timeout=2)}
+
+    assert "timed out" in results[stuck].error
+    # With one worker the second file only converts if the stuck one was killed and replaced
+    assert results[after].chunks == ["Converted by the replacement worker."]
+    assert time.monotonic() - start < 60
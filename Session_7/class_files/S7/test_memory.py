@@ -0,0 +1,172 @@
+# test_memory.py
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import embedding
+import embed_server
+from agent import recall
+from embedding import HASH_EMBED_MODEL
+from memory import MemoryItem, MemoryManager, RetentionPolicy
+from vector_index import IndexConfig
+
+DIM = 64
+
+
+@pytest.fixture(scope="module")
+def embed_url():
+    """embed_server.py on a free port: deterministic vectors, no Ollama needed."""
+    server = embed_server.serve(port=0, dim=DIM, background=True)
+    yield f"http://127.0.0.1:{server.server_port}/api/embed"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_disk_cache(monkeypatch):
+    # Keep the persistent embedding cache out of the repo's faiss_index/
+    monkeypatch.setattr(embedding, "EMBED_CACHE_PATH", None)
+    monkeypatch.setattr(embedding, "_cache", None)
+
+
+@pytest.fixture
+def manager(embed_url):
+    managers = []
+
+    def make(**kwargs):
+        m = MemoryManager(embedding_model_url=embed_url, model_name=HASH_EMBED_MODEL, **kwargs)
+        managers.append(m)
+        return m
+
+    yield make
+    for m in managers:
+        m.close()
+
+
+def texts(items):
+    return [item.text for item in items]
+
+
+def test_new_manager_retrieves_what_an_earlier_one_stored(manager, tmp_path):
+    first = manager(path=tmp_path / "mem")
+    first.add(MemoryItem(text="invoice total was 4200 rupees", type="tool_output", session_id="run-1"))
+    first.add(MemoryItem(text="apples are red", type="tool_output", session_id="run-1"))
+    first.close()
+
+    second = manager(path=tmp_path / "mem")
+
+    assert len(second) == 2
+    assert texts(second.retrieve("invoice total rupees", top_k=1)) == ["invoice total was 4200 rupees"]
+    assert second.retrieve("invoice total rupees", session_filter="run-2") == []
+
+
+def test_recall_includes_memories_from_earlier_runs(manager, tmp_path):
+    first = manager(path=tmp_path / "mem")
+    first.add(MemoryItem(text="invoice total was 4200 rupees", type="tool_output", session_id="run-1"))
+    first.close()
+
+    second = manager(path=tmp_path / "mem")
+    second.add(MemoryItem(text="invoice number INV-7", type="tool_output", session_id="run-2"))
+
+    recalled = recall(second, "invoice total rupees", "run-2")
+
+    assert texts(recalled) == ["invoice number INV-7", "invoice total was 4200 rupees"]
+
+
+def facts(n, **fields):
+    return [MemoryItem(text=f"fact number {i}", **fields) for i in range(n)]
+
+
+def test_max_items_evicts_oldest_down_to_evict_to(manager):
+    m = manager(retention=RetentionPolicy(max_items=10, evict_to=0.8, merge_threshold=None))
+    m.bulk_add(facts(10))
+    assert len(m) == 10
+
+    m.add(MemoryItem(text="one too many"))
+
+    assert len(m) == 8
+    assert sorted(texts(m.retrieve("fact number", top_k=10))) == [f"fact number {i}" for i in range(3, 10)] + [
+        "one too many"]
+
+
+def test_max_per_session_only_trims_that_session(manager):
+    m = manager(retention=RetentionPolicy(max_per_session=4, evict_to=0.5, merge_threshold=None))
+    m.bulk_add(facts(3, session_id="a"))
+    m.bulk_add(facts(4, session_id="b"))
+
+    m.add(MemoryItem(text="fifth in b", session_id="b"))
+
+    assert len(m.retrieve("fact", top_k=10, session_filter="a")) == 3
+    assert sorted(texts(m.retrieve("fact", top_k=10, session_filter="b"))) == ["fact number 3", "fifth in b"]
+
+
+def test_ttl_forgets_expired_memories_of_that_type(manager):
+    m = manager(retention=RetentionPolicy(ttl={"tool_output": 3600}, merge_threshold=None))
+    old = (datetime.now() - timedelta(hours=2)).isoformat()
+    m.bulk_add([MemoryItem(text="stale tool result", type="tool_output", timestamp=old),
+                MemoryItem(text="stale fact", type="fact", timestamp=old)])
+
+    m.add(MemoryItem(text="fresh tool result", type="tool_output"))
+
+    assert sorted(texts(m.retrieve("result", top_k=10))) == ["fresh tool result", "stale fact"]
+
+
+def test_consolidate_keeps_newest_near_duplicate_per_group(manager):
+    m = manager()
+    output = dict(type="tool_output", tool_name="search", session_id="s")
+    m.add(MemoryItem(text="weather in Delhi: 31C", user_query="first", **output))
+    m.add(MemoryItem(text="weather in Delhi: 31C", user_query="second", tool_name="other", type="tool_output",
+                     session_id="s"))
+    m.add(MemoryItem(text="weather in Delhi: 31C", user_query="third", **output))
+
+    kept = m.retrieve("weather in Delhi", top_k=10)
+
+    assert sorted(item.user_query for item in kept) == ["second", "third"]
+
+
+def test_hnsw_skips_forgotten_ids_until_rebuild(manager, tmp_path):
+    m = manager(path=tmp_path / "mem", index_config=IndexConfig(index_type="hnsw", metric="cosine"))
+    m.bulk_add(facts(10))
+
+    m.forget([0])
+    assert m.index.ntotal == 10  # marked dead, not rebuilt yet
+    assert "fact number 0" not in texts(m.retrieve("fact number 0", top_k=10))
+    m.snapshot()
+    m.close()
+
+    reopened = manager(path=tmp_path / "mem", index_config=IndexConfig(index_type="hnsw", metric="cosine"))
+    assert len(reopened) == 9
+    assert "fact number 0" not in texts(reopened.retrieve("fact number 0", top_k=10))
+
+    reopened.forget([1])  # 2 of 10 dead reaches HNSW_REBUILD_DEAD_SHARE
+    assert reopened.index.ntotal == 8
+    assert sorted(texts(reopened.retrieve("fact number", top_k=10))) == [f"fact number {i}" for i in range(2, 10)]
+
+
+def test_matching_ids_intersects_filters(manager):
+    m = manager()
+    m.bulk_add([MemoryItem(text="a", type="fact", tags=["x"], session_id="s1"),
+                MemoryItem(text="b", type="tool_output", tags=["y"], session_id="s1"),
+                MemoryItem(text="c", type="fact", tags=["y", "z"], session_id="s2"),
+                MemoryItem(text="d", type="fact", tags=["z"], session_id="s1")])
+
+    assert m._matching_ids(None, None, None) is None
+    assert m._matching_ids("fact", None, None).tolist() == [0, 2, 3]
+    assert m._matching_ids("fact", ["x", "z"], None).tolist() == [0, 2, 3]
+    assert m._matching_ids("fact", ["x", "z"], "s1").tolist() == [0, 3]
+    assert m._matching_ids(None, ["missing"], None).tolist() == []
+    assert m._matching_ids(None, [], None) is None
+
+
+def test_filtered_retrieve_finds_rare_matches(manager):
+    m = manager()
+    m.bulk_add([MemoryItem(text=f"invoice total {i}", type="fact") for i in range(200)])
+    m.bulk_add([MemoryItem(text="the cat sat on the mat", type="preference", tags=["pets"]),
+                MemoryItem(text="dogs bark at night", type="preference", tags=["pets"])])
+
+    # Neither is among the 200 nearest to the query, but the filter is applied inside the search
+    found = m.retrieve("invoice total", top_k=2, type_filter="preference", tag_filter=["pets"])
+
+    assert sorted(texts(found)) == ["dogs bark at night", "the cat sat on the mat"]
+    assert m.retrieve("invoice total", type_filter="query") == []
@@ -0,0 +1,138 @@
+# test_memory_store.py
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from memory_store import MemoryStore
+
+DIM = 3
+MODEL = "test-embed"
+
+
+def vectors(*rows):
+    return np.array([[row] * DIM for row in rows], dtype=np.float32)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MemoryStore(tmp_path / "mem")
+    yield store
+    store.close()
+
+
+def test_append_and_load(store):
+    store.append(['{"text": "a"}', '{"text": "b"}'], vectors(1, 2), MODEL)
+    store.append(['{"text": "c"}'], vectors(3), MODEL)
+
+    lines, loaded = store.load()
+
+    assert lines == ['{"text": "a"}', '{"text": "b"}', '{"text": "c"}']
+    np.testing.assert_array_equal(loaded[:, 0], [1, 2, 3])
+    with pytest.raises(ValueError):
+        store.append(['{"text": "d"}'], vectors(4), "other-model")
+
+
+def test_load_trims_torn_tail(store):
+    store.append(['{"text": "a"}', '{"text": "b"}'], vectors(1, 2), MODEL)
+    # Crash mid-append: the vector is half written and the log line has no newline
+    with open(store.vectors_path, "ab") as f:
+        f.write(vectors(3).tobytes()[:5])
+    with open(store.items_path, "ab") as f:
+        f.write(b'{"text": "c')
+
+    lines, loaded = store.load()
+
+    assert lines == ['{"text": "a"}', '{"text": "b"}']
+    assert len(loaded) == 2
+    assert store.vectors_path.stat().st_size == 2 * DIM * 4
+    assert store.items_path.read_bytes() == b'{"text": "a"}\n{"text": "b"}\n'
+
+    store.append(['{"text": "c"}'], vectors(3), MODEL)
+    lines, loaded = store.load()
+    assert lines[-1] == '{"text": "c"}'
+    np.testing.assert_array_equal(loaded[:, 0], [1, 2, 3])
+
+
+def test_load_drops_vector_without_log_line(store):
+    store.append(['{"text": "a"}'], vectors(1), MODEL)
+    # Crash between the vector write and the log line
+    with open(store.vectors_path, "ab") as f:
+        f.write(vectors(2).tobytes())
+
+    lines, loaded = store.load()
+
+    assert lines == ['{"text": "a"}']
+    assert len(loaded) == 1
+    assert store.vectors_path.stat().st_size == DIM * 4
+
+
+def test_deleted_ignores_partial_id(store):
+    store.append(['{"text": "a"}', '{"text": "b"}'], vectors(1, 2), MODEL)
+    store.delete(np.array([1]))
+    with open(store.deleted_path, "ab") as f:
+        f.write(b"\x00\x00\x00")
+
+    assert store.deleted().tolist() == [1]
+
+
+def test_rewrite_replaces_store(store):
+    store.append(['{"text": "a"}', '{"text": "b"}'], vectors(1, 2), MODEL)
+    store.delete(np.array([0]))
+
+    store.rewrite(['{"text": "b"}'], vectors(2))
+
+    lines, loaded = store.load()
+    assert lines == ['{"text": "b"}']
+    np.testing.assert_array_equal(loaded[:, 0], [2])
+    assert store.deleted().tolist() == []
+    assert json.loads(store.meta_path.read_text()) == {"dim": DIM, "model": MODEL}
+
+
+def test_recover_finishes_interrupted_rewrite(tmp_path):
+    directory = tmp_path / "mem"
+    old = MemoryStore(directory)
+    old.append(['{"text": "old"}'], vectors(1), MODEL)
+    old.close()
+    fresh = MemoryStore(tmp_path / "mem.rewrite", lock=False)
+    fresh.append(['{"text": "new"}'], vectors(2), MODEL)
+    # Crashed after moving the store aside, before moving the rewrite into place
+    directory.rename(tmp_path / "mem.old")
+
+    store = MemoryStore(directory)
+
+    assert store.load()[0] == ['{"text": "new"}']
+    assert not (tmp_path / "mem.rewrite").exists()
+    assert not (tmp_path / "mem.old").exists()
+    store.close()
+
+
+def test_recover_discards_unfinished_rewrite(tmp_path):
+    directory = tmp_path / "mem"
+    store = MemoryStore(directory)
+    store.append(['{"text": "kept"}'], vectors(1), MODEL)
+    store.close()
+    # Crashed while the new store was still being written
+    (tmp_path / "mem.rewrite").mkdir()
+
+    store = MemoryStore(directory)
+
+    assert store.load()[0] == ['{"text": "kept"}']
+    assert not (tmp_path / "mem.rewrite").exists()
+    store.close()
+
+
+def test_store_is_locked_to_one_owner(store):
+    with pytest.raises(RuntimeError, match="already open"):
+        MemoryStore(store.directory)
+
+    code = f"from memory_store import MemoryStore; MemoryStore({str(store.directory)!r})"
+    result = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent, capture_output=True, text=True)
+    assert result.returncode != 0 and "already open" in result.stderr
+
+    store.close()
+    MemoryStore(store.directory).close()
@@ -0,0 +1,103 @@
+# test_vector_index.py
+
+import faiss
+import numpy as np
+import pytest
+
+from vector_index import (SQ_MIN_TRAINING, IndexConfig, add_vectors, conform, export_vectors, index_storage,
+                          make_index, rerank, search_subset, similarity_matrix)
+
+DIM = 8
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, DIM), dtype=np.float32)
+
+
+def build(vectors, config):
+    index = make_index(DIM, config)
+    add_vectors(index, vectors, np.arange(len(vectors)), config)
+    return index
+
+
+@pytest.mark.parametrize("exact_limit", [4096, 0])  # scored from reconstructed vectors / IDSelector in FAISS
+def test_search_subset_only_returns_subset_ids(exact_limit):
+    vectors = random_vectors(500)
+    index = build(vectors, IndexConfig(index_type="hnsw"))
+    subset = np.arange(1, 500, 7)
+
+    D, ids = search_subset(index, vectors[0:1], subset, 5, exact_limit=exact_limit)
+
+    expected = subset[np.argsort(((vectors[subset] - vectors[0]) ** 2).sum(axis=1))[:5]]
+    assert ids.tolist() == expected.tolist()
+    assert np.all(np.diff(D) >= 0)
+
+
+def test_search_subset_small_subset_is_exact():
+    vectors = random_vectors(500)
+    index = build(vectors, IndexConfig(index_type="hnsw"))
+
+    # An HNSW walk restricted to two far-apart ids can miss one; exact scoring can't
+    assert sorted(search_subset(index, vectors[0:1], np.array([8, 400]), 5)[1].tolist()) == [8, 400]
+
+
+def test_similarity_matrix_matches_pairwise_definitions():
+    a, b = random_vectors(5, seed=1), random_vectors(3, seed=2)
+    unit = lambda v: v / np.linalg.norm(v)
+
+    expected = {
+        "ip": [[x @ y for y in b] for x in a],
+        "cosine": [[unit(x) @ unit(y) for y in b] for x in a],
+        "l2": [[((x - y) ** 2).sum() for y in b] for x in a],
+    }
+    for metric, values in expected.items():
+        np.testing.assert_allclose(similarity_matrix(a, b, metric=metric), values, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(np.diag(similarity_matrix(a)), 1, rtol=1e-5)
+
+
+def test_conform_rebuilds_for_a_new_metric():
+    vectors = random_vectors(50)
+    index = build(vectors, IndexConfig(metric="l2"))
+    config = IndexConfig(metric="cosine")
+
+    converted = conform(index, config)
+
+    assert converted.metric_type == faiss.METRIC_INNER_PRODUCT
+    ids, stored = export_vectors(converted)
+    assert ids.tolist() == list(range(50))
+    np.testing.assert_allclose(np.linalg.norm(stored, axis=1), 1, rtol=1e-5)  # cosine vectors are normalised
+    assert conform(converted, config) is converted
+    # Nearest by cosine: the vector itself
+    assert converted.search(np.ascontiguousarray(stored[7:8]), 1)[1][0, 0] == 7
+
+
+def test_conform_converts_storage():
+    vectors = random_vectors(50)
+    half = conform(build(vectors, IndexConfig()), IndexConfig(storage="float16"))
+
+    assert index_storage(half) == "float16"
+    ids, stored = export_vectors(half)
+    assert ids.tolist() == list(range(50))
+    np.testing.assert_allclose(stored, vectors, atol=1e-3)
+
+
+def test_int8_waits_for_enough_training_vectors():
+    config = IndexConfig(storage="int8")
+    index = build(random_vectors(SQ_MIN_TRAINING - 1), config)
+    assert index_storage(conform(index, config)) == "float32"
+
+    add_vectors(index, random_vectors(1, seed=1), np.array([SQ_MIN_TRAINING - 1]), config)
+    assert index_storage(conform(index, config)) == "int8"
+
+
+@pytest.mark.parametrize("metric, faiss_metric", [("l2", faiss.METRIC_L2), ("ip", faiss.METRIC_INNER_PRODUCT)])
+def test_rerank_orders_candidates_exactly(metric, faiss_metric):
+    query, vectors = random_vectors(1, seed=1), random_vectors(20)
+    ids = np.arange(100, 120)
+
+    scores, best = rerank(query, ids, vectors, 3, faiss_metric)
+
+    exact = similarity_matrix(query, vectors, metric=metric)[0]
+    order = np.argsort(exact if metric == "l2" else -exact)[:3]
+    assert best.tolist() == ids[order].tolist()
+    np.testing.assert_allclose(scores, exact[order], rtol=1e-5)
@@ -0,0 +1,88 @@
+# tool_registry.py
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp import ClientSession, types
+
+ServerKey = Tuple[str, str]  # (serverInfo.name, serverInfo.version)
+
+_registries: Dict[ServerKey, "ToolRegistry"] = {}
+
+
+class ToolRegistry:
+    """Client-side cache of one MCP server's tools.
+
+    Built once per tool list: the tools as the server returned them, a
+    name -> tool dict for O(1) lookup, each tool's input schema, and the
+    tool description text the planner prompt embeds. Registries are shared
+    per server name and version, so reconnecting to the same server reuses
+    them. A tools/list_changed notification (see ToolListWatcher) marks the
+    registry stale and the next refresh() reloads it; until then refresh()
+    costs nothing.
+    """
+
+    def __init__(self, server: ServerKey = ("", "")):
+        self.server = server
+        self.tools: List[types.Tool] = []
+        self.by_name: Dict[str, types.Tool] = {}
+        self.schemas: Dict[str, Dict[str, Any]] = {}
+        self.descriptions = ""
+        self.stale = True
+        self.loads = 0
+
+    @classmethod
+    def for_server(cls, init: types.InitializeResult) -> "ToolRegistry":
+        key = (init.serverInfo.name, init.serverInfo.version)
+        if key not in _registries:
+            _registries[key] = cls(key)
+        return _registries[key]
+
+    def invalidate(self) -> None:
+        self.stale = True
+
+    def get(self, name: str) -> Optional[types.Tool]:
+        return self.by_name.get(name)
+
+    async def refresh(self, session: ClientSession, force: bool = False) -> "ToolRegistry":
+        """Reload the tool list from the server if it changed (or force); otherwise return at once."""
+        if not (self.stale or force):
+            return self
+        # Cleared first: a change announced while this fetch runs marks it stale again
+        self.stale = False
+        try:
+            tools: List[types.Tool] = []
+            cursor = None
+            while True:
+                result = await (session.list_tools(cursor) if cursor else session.list_tools())
+                tools.extend(result.tools)
+                cursor = getattr(result, "nextCursor", None)
+                if not cursor:
+                    break
+        except BaseException:
+            self.stale = True
+            raise
+        self.tools = tools
+        self.by_name = {tool.name: tool for tool in tools}
+        self.schemas = {tool.name: tool.inputSchema for tool in tools}
+        self.descriptions = "\n".join(
+            f"- {tool.name}: {tool.description or 'No description'}"
+            for tool in tools
+        )
+        self.loads += 1
+        return self
+
+
+class ToolListWatcher:
+    """message_handler for a ClientSession: marks the session's registry stale on tools/list_changed.
+
+    The registry is only known once the session is initialized, so set
+    watcher.registry after initialize().
+    """
+
+    def __init__(self):
+        self.registry: Optional[ToolRegistry] = None
+
+    async def __call__(self, message: Any) -> None:
+        if (self.registry is not None and isinstance(message, types.ServerNotification)
+                and isinstance(message.root, types.ToolListChangedNotification)):
+            self.registry.invalidate()
@@ -0,0 +1,296 @@
+# vector_index.py
+
+import json
+from pathlib import Path
+from typing import Literal, Optional, Tuple
+
+import faiss
+import numpy as np
+from pydantic import BaseModel
+
+IndexType = Literal["flat", "ivf_flat", "ivf_pq", "hnsw"]
+Metric = Literal["l2", "ip", "cosine"]
+Storage = Literal["float32", "float16", "int8"]
+IVF_TYPES = ("ivf_flat", "ivf_pq")
+MIN_POINTS_PER_CENTROID = 39  # below this FAISS k-means warns and centroids are poor
+SQ_TYPES = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+SQ_MIN_TRAINING = 1000  # int8 learns per-dimension ranges; below this vectors are kept as float32
+RERANK_FACTOR = 4  # reduced-precision indexes fetch this many times more candidates for float32 rerank
+EXACT_SUBSET_LIMIT = 4096  # filtered searches over at most this many ids are scored exactly
+
+
+class IndexConfig(BaseModel):
+    """How a vector index is built and searched.
+
+    IVF types need training, so they start out as an exact flat index and are
+    trained and rebuilt once the corpus reaches train_threshold vectors.
+    metric "cosine" is inner product over vectors normalised on the way in;
+    use add_vectors() so they are. storage float16 halves and int8 quarters
+    the memory per vector (ivf_pq already compresses and ignores it); keep
+    the float32 vectors elsewhere and rerank() candidates against them to
+    win back the precision.
+    """
+    index_type: IndexType = "flat"
+    metric: Metric = "l2"
+    storage: Storage = "float32"
+    train_threshold: int = 20_000
+    nlist: int = 1024          # IVF: number of coarse clusters
+    pq_m: int = 64             # IVF-PQ: sub-quantizers (rounded down to a divisor of dim)
+    pq_nbits: int = 8          # IVF-PQ: bits per sub-quantizer code
+    hnsw_m: int = 32           # HNSW: graph neighbours per node
+    ef_construction: int = 200
+    nprobe: int = 16           # IVF: clusters visited per query
+    ef_search: int = 64        # HNSW: candidate list size per query
+
+    def build_params(self) -> dict:
+        """Fields that change the on-disk structure; a mismatch means the index must be rebuilt."""
+        return self.model_dump(include={"index_type", "metric", "storage", "nlist", "pq_m", "pq_nbits", "hnsw_m", "ef_construction"})
+
+    @property
+    def faiss_metric(self) -> int:
+        return faiss.METRIC_L2 if self.metric == "l2" else faiss.METRIC_INNER_PRODUCT
+
+
+def prepare_vectors(vectors: np.ndarray, config: IndexConfig) -> np.ndarray:
+    """float32, C-contiguous and, for the cosine metric, L2-normalised (as a copy)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if config.metric == "cosine" and len(vectors):
+        vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def add_vectors(index: faiss.Index, vectors: np.ndarray, ids: np.ndarray, config: IndexConfig) -> None:
+    index.add_with_ids(prepare_vectors(vectors, config), np.ascontiguousarray(ids, dtype=np.int64))
+
+
+def similarity_matrix(a: np.ndarray, b: Optional[np.ndarray] = None, metric: Metric = "cosine") -> np.ndarray:
+    """All-pairs similarity between the rows of a and b (default: a itself) as one matrix product.
+
+    cosine and ip give higher-is-closer scores; l2 gives squared distances.
+    """
+    a = np.asarray(a, dtype=np.float32)
+    b = a if b is None else np.asarray(b, dtype=np.float32)
+    if metric == "cosine":
+        a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+        b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    dots = a @ b.T
+    if metric == "l2":
+        return np.maximum((a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2 * dots, 0)
+    return dots
+
+
+def index_kind(index: faiss.Index) -> str:
+    """The structure actually in use: flat, ivf_flat, ivf_pq or hnsw."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def index_storage(index: faiss.Index) -> str:
+    """How vectors are held: float32, float16, int8, or pq for IVF-PQ codes."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "pq"
+    sq = getattr(inner, "sq", None)
+    if sq is not None:
+        return next(name for name, qtype in SQ_TYPES.items() if qtype == sq.qtype)
+    return "float32"
+
+
+def target_storage(kind: str, config: IndexConfig, n: int) -> str:
+    """Storage an index of this kind holding n vectors should use under config."""
+    if kind == "ivf_pq":
+        return "pq"
+    if config.index_type == "ivf_pq" or (config.storage == "int8" and n < SQ_MIN_TRAINING):
+        return "float32"
+    return config.storage
+
+
+def _pq_m(dim: int, wanted: int) -> int:
+    return max(m for m in range(1, min(wanted, dim) + 1) if dim % m == 0)
+
+
+def make_index(dim: int, config: IndexConfig, training: Optional[np.ndarray] = None) -> faiss.Index:
+    """Create an empty index for config.
+
+    IVF types and int8 storage are only built when enough training vectors
+    are given; otherwise a float32 flat index (or float32 storage) is
+    returned and conform() upgrades it later.
+    """
+    kind = config.index_type
+    metric = config.faiss_metric
+    if kind in IVF_TYPES:
+        if training is None or len(training) < max(config.train_threshold, MIN_POINTS_PER_CENTROID):
+            kind = "flat"
+    storage = target_storage(kind, config, 0 if training is None else len(training))
+
+    if kind in ("flat", "hnsw"):
+        if kind == "flat":
+            inner = faiss.IndexFlat(dim, metric) if storage == "float32" else \
+                faiss.IndexScalarQuantizer(dim, SQ_TYPES[storage], metric)
+        else:
+            inner = faiss.IndexHNSWFlat(dim, config.hnsw_m, metric) if storage == "float32" else \
+                faiss.IndexHNSWSQ(dim, SQ_TYPES[storage], config.hnsw_m, metric)
+            inner.hnsw.efConstruction = config.ef_construction
+            inner.hnsw.efSearch = config.ef_search
+        if not inner.is_trained:
+            inner.train(prepare_vectors(training, config))
+        return faiss.IndexIDMap2(inner)
+
+    # IVF indexes store ids natively; wrapping them in IndexIDMap would break remove_ids
+    nlist = max(1, min(config.nlist, len(training) // MIN_POINTS_PER_CENTROID))
+    quantizer = faiss.IndexFlat(dim, metric)
+    if kind == "ivf_pq":
+        ivf = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim, config.pq_m), config.pq_nbits, metric)
+    elif storage == "float32":
+        ivf = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+    else:
+        ivf = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, SQ_TYPES[storage], metric)
+    ivf.train(prepare_vectors(training, config))
+    ivf.nprobe = config.nprobe
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)  # reconstruct() and remove by id
+    return ivf
+
+
+def export_vectors(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (ids, vectors) for everything in the index. Lossy for IVF-PQ and reduced-precision storage."""
+    if index.ntotal == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, index.d), dtype=np.float32)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        return ids, faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+    ivf = faiss.extract_index_ivf(index)
+    invlists = ivf.invlists
+    ids = np.concatenate([
+        faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+        for l in range(ivf.nlist) if invlists.list_size(l)
+    ]).astype(np.int64)
+    return ids, index.reconstruct_batch(ids)
+
+
+def rebuild(index: faiss.Index, config: IndexConfig, drop: Optional[np.ndarray] = None) -> faiss.Index:
+    """Rebuild index as config describes, optionally without the ids in drop."""
+    ids, vectors = export_vectors(index)
+    if drop is not None and len(drop):
+        keep = ~np.isin(ids, drop)
+        ids, vectors = ids[keep], vectors[keep]
+    fresh = make_index(index.d, config, training=_training_sample(vectors, config))
+    if len(ids):
+        add_vectors(fresh, vectors, ids, config)
+    return fresh
+
+
+def _training_sample(vectors: np.ndarray, config: IndexConfig) -> np.ndarray:
+    # k-means gains little past ~256 points per centroid
+    limit = max(config.train_threshold, config.nlist * 256)
+    if len(vectors) <= limit:
+        return vectors
+    rng = np.random.default_rng(0)
+    return vectors[rng.choice(len(vectors), limit, replace=False)]
+
+
+def conform(index: faiss.Index, config: IndexConfig, built_with: Optional[dict] = None) -> faiss.Index:
+    """Train or convert index so its structure matches config. Returns the same object if nothing changes.
+
+    built_with is the saved config of the index (see save_config); if its build
+    parameters differ from config the index is rebuilt even when the type matches.
+    """
+    kind = index_kind(index)
+    if index.metric_type != config.faiss_metric:
+        return rebuild(index, config)
+    if kind != "flat" and built_with is not None:
+        # Configs saved before a field existed were built with its default
+        built = {k: built_with.get(k, IndexConfig.model_fields[k].default) for k in config.build_params()}
+        if built != config.build_params():
+            return rebuild(index, config)
+    if config.index_type in IVF_TYPES:
+        if kind == config.index_type or (index.ntotal < config.train_threshold and kind == "flat"):
+            return _conform_storage(index, kind, config)
+    elif kind == config.index_type:
+        return _conform_storage(index, kind, config)
+    return rebuild(index, config)
+
+
+def _conform_storage(index: faiss.Index, kind: str, config: IndexConfig) -> faiss.Index:
+    if index_storage(index) == target_storage(kind, config, index.ntotal):
+        return index
+    return rebuild(index, config)
+
+
+def remove_ids(index: faiss.Index, ids: np.ndarray, config: IndexConfig) -> faiss.Index:
+    """Remove ids from index. HNSW can't delete in place, so it is rebuilt without them."""
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if not len(ids):
+        return index
+    if index_kind(index) == "hnsw":
+        return rebuild(index, config, drop=ids)
+    index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+    return index
+
+
+def search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                  sel: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """Per-query search knobs. Passed to index.search(params=...) so concurrent queries don't share state."""
+    kind = index_kind(index)
+    if kind in IVF_TYPES:
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or faiss.extract_index_ivf(index).nprobe
+    elif kind == "hnsw":
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or faiss.downcast_index(index.index).hnsw.efSearch
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+
+def search_subset(index: faiss.Index, query: np.ndarray, ids: np.ndarray, k: int,
+                  exact_limit: int = EXACT_SUBSET_LIMIT) -> Tuple[np.ndarray, np.ndarray]:
+    """Search only among ids. Returns (distances, ids) of the best k, nearest first.
+
+    Small subsets are scored exactly from their reconstructed vectors, so the
+    cost follows the subset size and approximate indexes can't miss a match.
+    Larger ones are searched with an IDSelector inside FAISS.
+    """
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    query = np.ascontiguousarray(query, dtype=np.float32).reshape(1, -1)
+    if len(ids) <= exact_limit:
+        return rerank(query, ids, index.reconstruct_batch(ids), k, index.metric_type)
+    sel = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+    D, I = index.search(query, k, params=search_params(index, sel=sel))
+    keep = I[0] >= 0
+    return D[0][keep], I[0][keep]
+
+
+def rerank(query: np.ndarray, ids: np.ndarray, vectors: np.ndarray, k: int,
+           metric_type: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Re-score candidate ids exactly against their float32 vectors; returns the best k (scores, ids)."""
+    query = np.ascontiguousarray(query, dtype=np.float32).reshape(1, -1)
+    if metric_type == faiss.METRIC_INNER_PRODUCT:
+        scores = similarity_matrix(query, vectors, metric="ip")[0]
+        order = np.argsort(-scores, kind="stable")[:k]
+    else:
+        scores = similarity_matrix(query, vectors, metric="l2")[0]
+        order = np.argsort(scores, kind="stable")[:k]
+    return scores[order], np.asarray(ids)[order]
+
+
+def save_config(path: Path, index: faiss.Index, config: IndexConfig) -> None:
+    """Record how the index on disk was built next to it."""
+    Path(path).write_text(json.dumps({**config.model_dump(), "kind": index_kind(index), "ntotal": index.ntotal}, indent=2))
+
+
+def load_config(path: Path) -> Optional[dict]:
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else None
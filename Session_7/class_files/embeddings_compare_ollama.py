@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.spatial.distance import cosine
 import requests
 import json
 
@@ -23,14 +22,15 @@ sentences = [
 ]
 
 # 🧠 Get embeddings
-embeddings = [get_embedding(s) for s in sentences]
+embeddings = np.stack([get_embedding(s) for s in sentences])
 
-# 🔁 Compare all pairs using cosine similarity
-def cosine_similarity(v1, v2):
-    return 1 - cosine(v1, v2)  # 1 = perfect match
+# 🔁 Compare all pairs using cosine similarity: normalise once, then one matrix multiply
+def cosine_similarity_matrix(vectors):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return unit @ unit.T  # 1 = perfect match
+
+similarity = cosine_similarity_matrix(embeddings)
 
 print("🔍 Semantic Similarity Matrix:\n")
-for i in range(len(sentences)):
-    for j in range(i + 1, len(sentences)):
-        sim = cosine_similarity(embeddings[i], embeddings[j])
-        print(f"\"{sentences[i]}\" ↔ \"{sentences[j]}\" → similarity = {sim:.3f}")
+for i, j in zip(*np.triu_indices(len(sentences), k=1)):
+    print(f"\"{sentences[i]}\" ↔ \"{sentences[j]}\" → similarity = {similarity[i, j]:.3f}")